@@ -6,8 +6,7 @@ from langchain_openai import ChatOpenAI
 import os
 import logging
 import json
-from shared.event_publisher import EventPublisher
-import asyncio
+from shared.event_publisher import get_event_publisher
 
 load_dotenv()
 
@@ -52,7 +51,7 @@ async def analyze_order(customer_order: str) -> Ingredients:
         logger.info(f"Analysis output: {result.model_dump()}")
 
         # Publish event to Redis
-        publisher = EventPublisher()
+        publisher = get_event_publisher()
         # Format the analysis output for human readability
         human_readable_ingredients = ", ".join(
             f"{item.ingredient_name}: {item.amount} {item.unit}"
@@ -63,7 +62,7 @@ async def analyze_order(customer_order: str) -> Ingredients:
             "message": f"Analysis output: {human_readable_ingredients}",
             "order_id": str(customer_order),
         }
-        asyncio.create_task(publisher.publish_event(REDIS_CHANNEL, event_message))
+        await publisher.publish_event(REDIS_CHANNEL, event_message)
 
         return result
     except Exception as e:
@@ -2,6 +2,8 @@
 from temporalio.worker import Worker
 from temporalio.client import Client
 from shared.logging_config import setup_logging
+from shared.event_publisher import close_event_publisher
+from shared.temporal_context import TemporalContextInterceptor
 import asyncio
 import logging
 from analyze_order import analyze_order
@@ -12,7 +14,7 @@ async def main():
     setup_logging("analyze_order_worker")
     logger = logging.getLogger("analyze_order_worker.main")
     load_dotenv()
-    client = await Client.connect(os.getenv("TEMPORAL_ADDRESS"))
+    client = await Client.connect(os.getenv("TEMPORAL_ADDRESS"), interceptors=[TemporalContextInterceptor()])
     logger.info("Connected to Temporal server")
     worker = Worker(
         client,
@@ -20,7 +22,10 @@ async def main():
         activities=[analyze_order],
     )
     logger.info("Starting analyze_order worker...")
-    await worker.run()
+    try:
+        await worker.run()
+    finally:
+        await close_event_publisher()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
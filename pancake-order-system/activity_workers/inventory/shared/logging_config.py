@@ -1,52 +1,335 @@
+import atexit
+import contextvars
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import socket
 import sys
 import json
-from typing import Any, Dict
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+from contextlib import contextmanager
 from datetime import datetime
 
+import orjson
+
+from shared.metrics import metrics
+
+# Drop policies for a full log queue
+DROP_NEWEST = "newest"
+DROP_OLDEST = "oldest"
+
+# Temporal context of the running workflow, activity or request. Set by the
+# interceptors in shared.temporal_context; the dict is replaced, never mutated.
+temporal_context_var: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("temporal_context", default={})
+
+@contextmanager
+def bind_temporal_context(**fields: Any) -> Iterator[Dict[str, Any]]:
+    """Add fields to the Temporal context of every record logged inside the block."""
+    context = {**temporal_context_var.get(), **{k: v for k, v in fields.items() if v is not None}}
+    token = temporal_context_var.set(context)
+    try:
+        yield context
+    finally:
+        temporal_context_var.reset(token)
+
 class TemporalContextFilter(logging.Filter):
-    """Filter to add Temporal-specific context to log records."""
+    """
+    Filter to add Temporal-specific context to log records. Must run in the
+    thread that logs (it reads the caller's context variables); context passed
+    explicitly with a record takes precedence.
+    """
     
     def filter(self, record: logging.LogRecord) -> bool:
-        if not hasattr(record, 'temporal_context'):
-            record.temporal_context = {}
+        context = temporal_context_var.get()
+        explicit = getattr(record, 'temporal_context', None)
+        if explicit:
+            record.temporal_context = {**context, **explicit} if context else explicit
+        else:
+            record.temporal_context = context
         return True
 
+class LazyJson:
+    """
+    Defers serializing a pydantic model (or any JSON-able value) until a log
+    record is actually formatted, so records that are filtered, sampled out
+    or dropped cost nothing. Use as a %-style argument or a context value:
+        logger.info("Inventory check response: %s", lazy_json(result))
+    The value is serialized on the logging thread; don't mutate it after logging.
+    """
+    __slots__ = ("value", "indent")
+
+    def __init__(self, value: Any, indent: Optional[int] = None):
+        self.value = value
+        self.indent = indent
+
+    def to_json(self) -> Any:
+        if hasattr(self.value, "model_dump"):
+            return self.value.model_dump(mode="json")
+        return self.value
+
+    def __str__(self) -> str:
+        if self.indent and hasattr(self.value, "model_dump_json"):
+            return self.value.model_dump_json(indent=self.indent)
+        option = orjson.OPT_INDENT_2 if self.indent else 0
+        return orjson.dumps(self.to_json(), default=_json_default, option=option).decode()
+
+def lazy_json(value: Any, indent: Optional[int] = None) -> LazyJson:
+    return LazyJson(value, indent)
+
+# Log argument types safe to format later on another thread
+_DEFERRABLE = (str, int, float, bool, type(None), bytes, LazyJson)
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, LazyJson):
+        return value.to_json()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return str(value)
+
 def format_temporal_context(context: Dict[str, Any]) -> str:
     """Format Temporal context for logging."""
     if not context:
         return ""
-    return f" [Temporal: {json.dumps(context)}]"
+    return f" [Temporal: {json.dumps(context, default=_json_default)}]"
 
 class TemporalFormatter(logging.Formatter):
     """Custom formatter for Temporal-aware logging."""
     
     def format(self, record: logging.LogRecord) -> str:
-        # Add timestamp
-        record.timestamp = datetime.utcnow().isoformat()
+        # Add timestamp (when the record was created, not when a background thread formats it)
+        record.timestamp = datetime.utcfromtimestamp(record.created).isoformat()
         
         # Add Temporal context if available
         temporal_context = getattr(record, 'temporal_context', {})
         temporal_str = format_temporal_context(temporal_context)
+        suppressed = getattr(record, 'suppressed', 0)
+        suppressed_str = f" ({suppressed} similar suppressed)" if suppressed else ""
         
         # Format the message
-        return f"{record.timestamp} {record.levelname} [{record.name}]{temporal_str}: {record.getMessage()}"
+        return f"{record.timestamp} {record.levelname} [{record.name}]{temporal_str}: {record.getMessage()}{suppressed_str}"
 
-def setup_logging(service_name: str, log_level: str = "INFO") -> logging.Logger:
+class JsonFormatter(logging.Formatter):
+    """
+    One orjson-encoded JSON object per record. Fields that never change
+    (service, host, pid) are encoded once and spliced into every line, and the
+    timestamp's date and time part is reused for all records within a second.
+    """
+    def __init__(self, service_name: str, static_fields: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        static = {"service": service_name, "host": socket.gethostname(), "pid": os.getpid(), **(static_fields or {})}
+        # '"service":"...","host":"...",...' without the braces
+        self._static = orjson.dumps(static)[1:-1]
+        self._second = None
+        self._second_text = ""
+
+    def _timestamp(self, created: float) -> str:
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return f"{self._second_text}.{int((created - second) * 1000):03d}Z"
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self._timestamp(record.created),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        context = getattr(record, "temporal_context", None)
+        if context:
+            entry["temporal"] = context
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        body = orjson.dumps(entry, default=_json_default)
+        return (body[:-1] + b"," + self._static + b"}").decode()
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out repetitive records before they are queued or formatted.
+    Rules are keyed by logger name (a prefix matches its children) and level:
+      - sampling keeps each record with the given probability;
+      - rate limiting keeps at most N records per second per message template,
+        and the next record let through in the same second reports how many
+        were suppressed. The template is the unformatted `msg`, so this only
+        groups %-style calls (`logger.info("Order %s", order_id)`); an f-string
+        makes every message its own template.
+    Records without a matching rule always pass.
+    """
+    def __init__(
+        self,
+        sample_rates: Optional[Dict[Tuple[str, int], float]] = None,
+        rate_limits: Optional[Dict[Tuple[str, int], int]] = None,
+    ):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.rate_limits = rate_limits or {}
+        # (logger, msg template) -> [window start second, records in window, suppressed];
+        # only windows of the current second, plus the previous second's with
+        # suppressed records still to report, are kept
+        self._windows: Dict[Tuple[str, str], list] = {}
+        self._second = 0
+        self._rules: Dict[Tuple[str, int], Tuple[Optional[float], Optional[int]]] = {}
+
+    def _rule(self, name: str, level: int) -> Tuple[Optional[float], Optional[int]]:
+        key = (name, level)
+        if key not in self._rules:
+            rate = limit = None
+            # Most specific logger prefix wins; root is the fallback, so it sorts first
+            names = {n for n, _ in self.sample_rates} | {n for n, _ in self.rate_limits}
+            for logger_name in sorted(names, key=lambda n: 0 if n in ("", "root") else len(n) + 1):
+                if logger_name in ("", "root") or name == logger_name or name.startswith(logger_name + "."):
+                    rate = self.sample_rates.get((logger_name, level), rate)
+                    limit = self.rate_limits.get((logger_name, level), limit)
+            self._rules[key] = (rate, limit)
+        return self._rules[key]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate, limit = self._rule(record.name, record.levelno)
+        if rate is not None and random.random() >= rate:
+            metrics.counter("logging.sampled_out").inc()
+            return False
+        if limit is not None:
+            second = int(record.created)
+            if second > self._second:
+                # Drop past windows so distinct messages cannot pile up
+                self._windows = {k: w for k, w in self._windows.items() if w[2] and w[0] == self._second}
+                self._second = second
+            window = self._windows.setdefault((record.name, str(record.msg)), [second, 0, 0])
+            if window[0] != second:
+                window[0], window[1] = second, 0
+            if window[1] >= limit:
+                window[2] += 1
+                metrics.counter("logging.rate_limited").inc()
+                return False
+            window[1] += 1
+            if window[2]:
+                record.suppressed, window[2] = window[2], 0
+        return True
+
+def parse_log_rules(spec: str, cast) -> Dict[Tuple[str, int], Any]:
+    """
+    Parse 'logger:LEVEL=value,...' (e.g. 'kitchen_worker:INFO=0.1,inventory_worker.db:DEBUG=0.01').
+    Use 'root' as the logger name to match every logger.
+    """
+    rules = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        target, _, value = item.strip().rpartition("=")
+        name, _, level = target.rpartition(":")
+        rules[(name or "root", logging.getLevelName(level.upper()))] = cast(value)
+    return rules
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a bounded queue without ever blocking the caller.
+    When the queue is full a record is dropped (the new one, or the oldest
+    queued one) and counted in `dropped` and the `logging.dropped` metric.
+    """
+    def __init__(self, log_queue: queue.Queue, drop_policy: str = DROP_NEWEST):
+        super().__init__(log_queue)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the listener thread. Arguments that could still
+        # change are merged into the message now; immutable and lazy ones are not.
+        record = logging.makeLogRecord(record.__dict__)
+        args = record.args if isinstance(record.args, tuple) else ()
+        if record.args and not all(isinstance(a, _DEFERRABLE) for a in args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.drop_policy == DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+        metrics.counter("logging.dropped").inc()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def _stop_listener() -> None:
+    """Write out the records still queued and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(_stop_listener)
+
+def setup_logging(
+    service_name: str,
+    log_level: str = "INFO",
+    use_queue: Optional[bool] = None,
+    queue_size: Optional[int] = None,
+    drop_policy: Optional[str] = None,
+    log_format: Optional[str] = None,
+) -> logging.Logger:
     """
     Set up logging configuration for a service with Temporal awareness.
     Also configures the root logger so that logging from any module uses the same format.
+    In queue mode (the default) log calls only put the record on a bounded
+    queue; formatting and writing to stdout happen on a background thread, so
+    a slow sink never stalls the event loop.
     Args:
         service_name: Name of the service
         log_level: Logging level (default: INFO)
+        use_queue: Log through a background thread (default: LOG_QUEUE_ENABLED or True)
+        queue_size: Records buffered before the drop policy applies (default: LOG_QUEUE_SIZE or 10000)
+        drop_policy: 'newest' drops incoming records, 'oldest' the longest queued (default: LOG_QUEUE_DROP_POLICY or 'newest')
+        log_format: 'text' or 'json', one JSON object per line (default: LOG_FORMAT or 'text')
+    Records can be thinned out before they are queued with LOG_SAMPLING
+    ('logger:LEVEL=probability,...') and LOG_RATE_LIMIT ('logger:LEVEL=per_second,...').
     """
+    if use_queue is None:
+        use_queue = os.getenv("LOG_QUEUE_ENABLED", "true").lower() == "true"
+    if queue_size is None:
+        queue_size = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    if drop_policy is None:
+        drop_policy = os.getenv("LOG_QUEUE_DROP_POLICY", DROP_NEWEST)
+    if log_format is None:
+        log_format = os.getenv("LOG_FORMAT", "text")
+    sample_rates = parse_log_rules(os.getenv("LOG_SAMPLING", ""), float)
+    rate_limits = parse_log_rules(os.getenv("LOG_RATE_LIMIT", ""), int)
+
+    # Services may call this more than once; flush and replace the previous listener
+    _stop_listener()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter(service_name) if log_format == "json" else TemporalFormatter())
+    if use_queue:
+        global _listener
+        root_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size), drop_policy)
+        _listener = logging.handlers.QueueListener(root_handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root_handler = stream_handler
+    root_handler.addFilter(TemporalContextFilter())
+    if sample_rates or rate_limits:
+        # Runs in the calling thread, before the record is copied and queued
+        root_handler.addFilter(SamplingFilter(sample_rates, rate_limits))
+
     # Configure root logger
     root_logger = logging.getLogger()
     root_logger.setLevel(getattr(logging, log_level.upper()))
     root_logger.handlers = []
-    root_handler = logging.StreamHandler(sys.stdout)
-    root_handler.setFormatter(TemporalFormatter())
-    root_handler.addFilter(TemporalContextFilter())
     root_logger.addHandler(root_handler)
 
     # Configure service-specific logger (optional, for backward compatibility)
@@ -73,6 +356,8 @@ def log_with_temporal_context(
 ) -> None:
     """
     Log a message with Temporal-specific context.
+    Context bound by the Temporal interceptors (see shared.temporal_context)
+    is added automatically; only pass what it does not already cover.
     
     Args:
         logger: Logger instance
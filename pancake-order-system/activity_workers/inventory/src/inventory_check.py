@@ -1,8 +1,7 @@
-from shared.logging_config import get_logger, log_with_temporal_context  # Remove log_with_temporal_context
+from shared.logging_config import get_logger, lazy_json
 import os
 import logging
 from typing import List, Dict
-import json
 from dotenv import load_dotenv
 
 from langchain_openai import ChatOpenAI
@@ -13,8 +12,7 @@ from temporalio import activity
 from db_tools import check_ingredients_tool, get_inventory_tool
 from shared.interface import Ingredients, InventoryResponse
 
-from shared.event_publisher import EventPublisher
-import asyncio
+from shared.event_publisher import get_event_publisher
 
 load_dotenv()
 
@@ -96,7 +94,7 @@ async def inventory_check(order_id: str, ingredients: Ingredients) -> str:
 
         logger.info(f"Invoking agent with message: {initial_message}")
 
-        response = agent.invoke(initial_message)
+        response = await agent.ainvoke(initial_message)
         
         structured = response["structured_response"]
         result = InventoryResponse(
@@ -104,16 +102,16 @@ async def inventory_check(order_id: str, ingredients: Ingredients) -> str:
             missing_ingredients=structured.missing_ingredients,
             decision=structured.decision
         )
-        logger.info("Inventory check response:\n%s", json.dumps(result.model_dump(), indent=2, ensure_ascii=False))
+        logger.info("Inventory check response:\n%s", lazy_json(result, indent=2))
         
         # Publish event to Redis
-        publisher = EventPublisher()
+        publisher = get_event_publisher()
         event_message = {
             "status": "inventory_check",
             "message": f"Inventory check for order {order_id}: Decision - {result.decision}. Available: {', '.join(result.available_ingredients)}. Missing: {', '.join(result.missing_ingredients)}",
             "order_id": str(order_id),
         }
-        asyncio.create_task(publisher.publish_event(REDIS_CHANNEL, event_message))
+        await publisher.publish_event(REDIS_CHANNEL, event_message)
         return result
 
 
@@ -7,8 +7,10 @@ from dotenv import load_dotenv
 from temporalio.client import Client
 from temporalio.worker import Worker
 from shared.logging_config import setup_logging
+from shared.event_publisher import close_event_publisher
 from inventory_check import inventory_check
 from temporalio.contrib.pydantic import pydantic_data_converter
+from shared.temporal_context import TemporalContextInterceptor
 
 async def main():
     # Load environment variables
@@ -31,7 +33,8 @@ async def main():
         
         client = await Client.connect(
             temporal_server,
-            data_converter=pydantic_data_converter
+            data_converter=pydantic_data_converter,
+            interceptors=[TemporalContextInterceptor()]
         )
         logger.info("Successfully connected to Temporal server")
 
@@ -49,6 +52,8 @@ async def main():
     except Exception as e:
         logger.error(f"Critical error in inventory worker: {str(e)}", exc_info=True)
         raise
+    finally:
+        await close_event_publisher()
 
 if __name__ == "__main__":
     logger = setup_logging("inventory_worker", os.getenv("LOG_LEVEL", "INFO"))
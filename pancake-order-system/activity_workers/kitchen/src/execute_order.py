@@ -1,11 +1,11 @@
+import asyncio
 from temporalio import activity
 from shared.interface import Ingredients
+from shared.logging_config import lazy_json
 from db_tools_kitchen import subtract_ingredient_amount
 import logging
-import json
 
-from shared.event_publisher import EventPublisher
-import asyncio
+from shared.event_publisher import get_event_publisher
 from dotenv import load_dotenv
 import os
 
@@ -34,19 +34,21 @@ async def execute_order(order_id: str, ingredients: Ingredients) -> Ingredients:
     updated_ingredients = []
 
     # Publish event to Redis
-    publisher = EventPublisher()
+    publisher = get_event_publisher()
     event_message = {
         "status": "making",
         "message": "Making order.",
         "order_id": order_id,
     }
-    asyncio.create_task(publisher.publish_event(REDIS_CHANNEL, event_message))
+    await publisher.publish_event(REDIS_CHANNEL, event_message)
 
     try:
         for ingredient in ingredients.ingredients:
             logger.info(f"Consuming ingredient: {ingredient.ingredient_name}, amount: {ingredient.amount} {ingredient.unit}")
-            # Subtract the ingredient amount in the database and get the updated IngredientItem
-            updated_ingredient = subtract_ingredient_amount(
+            # Subtract the ingredient amount in the database and get the updated IngredientItem.
+            # The query blocks, so it runs in a thread to keep the worker's event loop responsive.
+            updated_ingredient = await asyncio.to_thread(
+                subtract_ingredient_amount,
                 ingredient.ingredient_name,
                 ingredient.amount,
                 ingredient.unit
@@ -54,12 +56,12 @@ async def execute_order(order_id: str, ingredients: Ingredients) -> Ingredients:
             logger.info(f"Updated ingredient: {updated_ingredient}")
             updated_ingredients.append(updated_ingredient)
         result_ingredients = Ingredients(ingredients=updated_ingredients)
-        logger.info("All ingredients consumed successfully: %s", json.dumps(result_ingredients.model_dump()))
+        logger.info("All ingredients consumed successfully: %s", lazy_json(result_ingredients))
         return result_ingredients
     except Exception as e:
         logger.error(f"Error consuming ingredients: {e}", exc_info=True)
         # Return the original ingredients with their original amounts if error
-        logger.info("Returning original ingredients due to error: %s", json.dumps(ingredients.model_dump()))
+        logger.info("Returning original ingredients due to error: %s", lazy_json(ingredients))
         return ingredients
 
 
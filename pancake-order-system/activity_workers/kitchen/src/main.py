@@ -3,8 +3,10 @@ import os
 from temporalio.client import Client
 from temporalio.worker import Worker
 from shared.logging_config import setup_logging
+from shared.event_publisher import close_event_publisher
 from execute_order import execute_order
 from temporalio.contrib.pydantic import pydantic_data_converter
+from shared.temporal_context import TemporalContextInterceptor
 import logging
 
 logger = logging.getLogger("kitchen_main")
@@ -28,7 +30,8 @@ async def main():
     try:
         client = await Client.connect(
             temporal_server,
-            data_converter=pydantic_data_converter
+            data_converter=pydantic_data_converter,
+            interceptors=[TemporalContextInterceptor()]
         )
         logger.info("Successfully connected to Temporal server")
         logger.info("Initializing worker with execute_order activity")
@@ -43,6 +46,8 @@ async def main():
     except Exception as e:
         logger.error(f"Error in kitchen worker main: {e}", exc_info=True)
         raise
+    finally:
+        await close_event_publisher()
 
 if __name__ == "__main__":
     logger = setup_logging("kitchen_worker", os.getenv("LOG_LEVEL", "INFO"))
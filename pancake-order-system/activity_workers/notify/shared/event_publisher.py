@@ -1,51 +1,277 @@
 import redis.asyncio as aioredis
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple, Union
+import asyncio
 import json
 import logging
 import os
+import zlib
+
+from shared.metrics import metrics
 
 # Configure module-level logger
 logger = logging.getLogger(__name__)
 
+# Supported transports: fire-and-forget Pub/Sub or durable Redis Streams
+TRANSPORT_PUBSUB = "pubsub"
+TRANSPORT_STREAMS = "streams"
+
+def shard_channel(channel: str, order_id: str, shards: int) -> str:
+    """
+    Map an order to its shard of `channel`. The hash is stable across processes,
+    so publishers and subscribers agree on the shard. With shards <= 1 the base
+    channel is used unchanged.
+    """
+    if shards <= 1:
+        return channel
+    return f"{channel}:{zlib.crc32(str(order_id).encode('utf-8')) % shards}"
+
+def shard_channels(channel: str, shards: int) -> List[str]:
+    """All shard channels of `channel`."""
+    if shards <= 1:
+        return [channel]
+    return [f"{channel}:{shard}" for shard in range(shards)]
+
 class EventPublisher:
     """
-    Publishes events to a Redis Pub/Sub channel.
-    Handles connection management and ensures messages conform to the required structure.
+    Publishes events to a Redis Pub/Sub channel, or appends them to a Redis
+    Stream of the same name when the streams transport is selected.
+    Events are queued in-process and flushed through a Redis pipeline every
+    few milliseconds or once a batch fills up, over a shared connection pool.
+    Use get_event_publisher() to obtain the process-wide instance.
     """
-    def __init__(self, redis_url: str = None):
+    def __init__(
+        self,
+        redis_url: str = None,
+        flush_interval_ms: float = None,
+        batch_size: int = None,
+        max_queue_size: int = None,
+        max_connections: int = None,
+        enqueue_timeout: float = None,
+        transport: str = None,
+        stream_maxlen: int = None,
+        shards: int = None,
+    ):
         """
         Initialize the EventPublisher with a Redis connection URL.
         Args:
             redis_url (str): The Redis server URL.
+            flush_interval_ms (float): Longest time an event waits in the queue before a flush.
+            batch_size (int): Number of queued events that triggers an immediate flush.
+            max_queue_size (int): Bound on queued events; publishers wait when it is reached.
+            max_connections (int): Size of the Redis connection pool.
+            enqueue_timeout (float): Seconds to wait for queue space before dropping an event.
+            transport (str): 'pubsub' (PUBLISH) or 'streams' (XADD with MAXLEN trimming).
+            stream_maxlen (int): Approximate number of entries kept per stream.
+            shards (int): Number of shard channels events are spread over by order_id.
         """
         if redis_url is None:
             redis_url = os.getenv("REDIS_ADDRESS", "redis://localhost:6379")
+        if flush_interval_ms is None:
+            flush_interval_ms = float(os.getenv("EVENT_PUBLISHER_FLUSH_INTERVAL_MS", 5))
+        if batch_size is None:
+            batch_size = int(os.getenv("EVENT_PUBLISHER_BATCH_SIZE", 100))
+        if max_queue_size is None:
+            max_queue_size = int(os.getenv("EVENT_PUBLISHER_MAX_QUEUE", 10000))
+        if max_connections is None:
+            max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", 4))
+        if enqueue_timeout is None:
+            enqueue_timeout = float(os.getenv("EVENT_PUBLISHER_ENQUEUE_TIMEOUT", 1.0))
+        if transport is None:
+            transport = os.getenv("EVENT_TRANSPORT", TRANSPORT_PUBSUB)
+        if stream_maxlen is None:
+            stream_maxlen = int(os.getenv("EVENT_STREAM_MAXLEN", 100000))
+        if shards is None:
+            shards = int(os.getenv("REDIS_CHANNEL_SHARDS", 1))
+        if transport not in (TRANSPORT_PUBSUB, TRANSPORT_STREAMS):
+            raise ValueError(f"Unsupported event transport: {transport}")
         self.redis_url = redis_url
+        self.transport = transport
+        self.stream_maxlen = stream_maxlen
+        self.shards = shards
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self.max_queue_size = max_queue_size
+        self.max_connections = max_connections
+        self.enqueue_timeout = enqueue_timeout
         self._redis: Optional[aioredis.Redis] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_waiters = 0
         # Log at info level for startup
-        logger.info(f"EventPublisher initialized with Redis URL: {self.redis_url}")
+        logger.info(f"EventPublisher initialized with Redis URL: {self.redis_url} (transport: {self.transport})")
+
+    def _ensure_started(self) -> None:
+        """Create the pool, queue and flusher task on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._flusher is not None and not self._flusher.done():
+            return
+        if self._redis is None or self._loop is not loop:
+            pool = aioredis.ConnectionPool.from_url(
+                self.redis_url,
+                max_connections=self.max_connections,
+                decode_responses=True
+            )
+            self._redis = aioredis.Redis(connection_pool=pool)
+            logger.info(f"Redis connection pool created (max_connections={self.max_connections}).")
+        if self._queue is None or self._loop is not loop:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._batch_ready = asyncio.Event()
+        self._loop = loop
+        self._flusher = loop.create_task(self._run())
 
     async def publish_event(self, channel: str, message: Dict[str, str]) -> None:
         """
-        Publishes a message to the specified Redis Pub/Sub channel.
+        Queues a message for the specified Redis Pub/Sub channel (or stream).
         Args:
-            channel (str): The channel to publish to.
+            channel (str): The channel (or stream key) to publish to; sharded by order_id when configured.
             message (Dict[str, str]): The message to publish. Must include 'status', 'message', 'order_id'.
         Raises:
             ValueError: If the message does not include all required fields.
         """
         try:
-            # Ensure the message contains all required fields
-            if not all(k in message for k in ('status', 'message', 'order_id')):
-                logger.error(f"Message missing required fields: {message}")
-                raise ValueError("Message must include 'status', 'message', and 'order_id' fields.")
-            # Lazily initialize the Redis connection if not already done
-            if not self._redis:
-                self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
-                logger.info("Redis connection established.")
-            # Publish the message as a JSON string
-            logger.info(f"Publishing to channel '{channel}': {message}")
-            await self._redis.publish(channel, json.dumps(message))
+            self._validate(message)
+            self._ensure_started()
+            logger.debug(f"Queueing event for channel '{channel}': {message}")
+            item = (shard_channel(channel, message['order_id'], self.shards), json.dumps(message))
+            await self._enqueue(item, f"order {message['order_id']}")
         except Exception as e:
             logger.error(f"Exception in publish_event: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    async def publish_events(self, channel: str, messages: List[Dict[str, str]]) -> None:
+        """
+        Queues several messages to be published together in one pipelined round-trip,
+        without waiting for the flush interval.
+        Args:
+            channel (str): The channel (or stream key) to publish to; sharded by order_id when configured.
+            messages (List[Dict[str, str]]): The messages to publish, each as for publish_event.
+        Raises:
+            ValueError: If any message does not include all required fields; nothing is queued then.
+        """
+        try:
+            for message in messages:
+                self._validate(message)
+            if not messages:
+                return
+            self._ensure_started()
+            logger.debug(f"Queueing {len(messages)} event(s) for channel '{channel}'")
+            group = [
+                (shard_channel(channel, message['order_id'], self.shards), json.dumps(message))
+                for message in messages
+            ]
+            await self._enqueue(group, f"{len(group)} orders")
+            self._batch_ready.set()
+        except Exception as e:
+            logger.error(f"Exception in publish_events: {e}")
+            raise
+
+    @staticmethod
+    def _validate(message: Dict[str, str]) -> None:
+        # Ensure the message contains all required fields
+        if not all(k in message for k in ('status', 'message', 'order_id')):
+            logger.error(f"Message missing required fields: {message}")
+            raise ValueError("Message must include 'status', 'message', and 'order_id' fields.")
+
+    async def _enqueue(self, item, description: str) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Backpressure: wait for the flusher to make room, then give up
+            try:
+                await asyncio.wait_for(self._queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                count = len(item) if isinstance(item, list) else 1
+                metrics.counter("event_publisher.dropped").inc(count)
+                logger.error(f"Event queue full; dropping event(s) for {description}")
+                return
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _run(self) -> None:
+        """Background task: collect queued events into batches and flush them."""
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                self._queue.task_done()
+                return
+            if self._queue.qsize() + 1 < self.batch_size and not self._batch_ready.is_set():
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [first]
+            stop = False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if self._queue.qsize() < self.batch_size and not self._flush_waiters:
+                self._batch_ready.clear()
+            await self._send(batch)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    async def _send(self, batch: List[Union[Tuple[str, str], List[Tuple[str, str]]]]) -> None:
+        """Publish a batch of events (single events or publish_events groups) in a single pipelined round-trip."""
+        events = [event for item in batch for event in (item if isinstance(item, list) else [item])]
+        try:
+            with metrics.timer("event_publisher.flush"):
+                pipe = self._redis.pipeline(transaction=False)
+                for channel, payload in events:
+                    if self.transport == TRANSPORT_STREAMS:
+                        pipe.xadd(channel, {"data": payload}, maxlen=self.stream_maxlen, approximate=True)
+                    else:
+                        pipe.publish(channel, payload)
+                await pipe.execute()
+            metrics.counter("event_publisher.published").inc(len(events))
+        except Exception as e:
+            metrics.counter("event_publisher.flush_errors").inc()
+            logger.error(f"Failed to flush {len(events)} event(s) to Redis: {e}")
+
+    async def flush(self) -> None:
+        """Publish everything currently queued without waiting for the flush interval."""
+        if self._flusher is None or self._flusher.done():
+            return
+        self._flush_waiters += 1
+        self._batch_ready.set()
+        try:
+            await self._queue.join()
+        finally:
+            self._flush_waiters -= 1
+
+    async def close(self) -> None:
+        """Publish any queued events, stop the flusher and release the connection pool."""
+        if self._flusher is not None and not self._flusher.done():
+            # The sentinel is queued behind pending events, so they are flushed first
+            await self._queue.put(None)
+            self._batch_ready.set()
+            await self._flusher
+        self._flusher = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            await self._redis.connection_pool.disconnect()
+            self._redis = None
+        logger.info("EventPublisher closed.")
+
+
+_publisher: Optional[EventPublisher] = None
+
+def get_event_publisher() -> EventPublisher:
+    """Return the process-wide EventPublisher, creating it on first use."""
+    global _publisher
+    if _publisher is None:
+        _publisher = EventPublisher()
+    return _publisher
+
+async def close_event_publisher() -> None:
+    """Flush and close the process-wide EventPublisher, if one was created."""
+    global _publisher
+    if _publisher is not None:
+        await _publisher.close()
+        _publisher = None
@@ -3,6 +3,7 @@ import asyncio
 from temporalio.worker import Worker
 from temporalio.client import Client
 from shared.logging_config import setup_logging
+from shared.temporal_context import TemporalContextInterceptor
 import logging
 from notify import notify
 import os
@@ -10,7 +11,7 @@ import os
 async def main():
     setup_logging("notify_worker")
     logger = logging.getLogger("notify_worker.main")
-    client = await Client.connect(os.getenv("TEMPORAL_ADDRESS"))
+    client = await Client.connect(os.getenv("TEMPORAL_ADDRESS"), interceptors=[TemporalContextInterceptor()])
     logger.info("Connected to Temporal server")
     worker = Worker(
         client,
@@ -0,0 +1,91 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+
+class LatencyStat:
+    """
+    Tracks count, total, last and max duration for a named operation.
+    Cheap enough to be updated on every request.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            avg = self.total / self.count if self.count else 0.0
+            return {
+                "count": self.count,
+                "avg_ms": round(avg * 1000, 3),
+                "last_ms": round(self.last * 1000, 3),
+                "max_ms": round(self.max * 1000, 3),
+            }
+
+
+class Counter:
+    """Monotonic counter safe to increment from several threads."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class MetricsRegistry:
+    """
+    Process-wide registry of counters and latency stats.
+    Metrics are created on first use and exposed as a plain dict via snapshot().
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Counter] = {}
+        self._latencies: Dict[str, LatencyStat] = {}
+
+    def counter(self, name: str) -> Counter:
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter()
+            return self._counters[name]
+
+    def latency(self, name: str) -> LatencyStat:
+        with self._lock:
+            if name not in self._latencies:
+                self._latencies[name] = LatencyStat()
+            return self._latencies[name]
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Context manager that records the duration of its block under `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latency(name).observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = dict(self._latencies)
+        return {
+            "counters": {name: c.value for name, c in counters.items()},
+            "latencies": {name: l.snapshot() for name, l in latencies.items()},
+        }
+
+
+# Shared registry for the current process
+metrics = MetricsRegistry()
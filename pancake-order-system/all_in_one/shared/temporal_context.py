@@ -0,0 +1,90 @@
+"""
+Temporal interceptors that bind workflow, activity and attempt context to the
+logging context (shared.logging_config.temporal_context_var), so every log
+record written while handling a workflow task, an activity or a workflow start
+carries it without callers passing it by hand.
+
+Pass the interceptor to Client.connect; workers created from that client pick
+it up automatically:
+    client = await Client.connect(address, interceptors=[TemporalContextInterceptor()])
+"""
+from typing import Any, Optional, Type
+
+from temporalio import activity, workflow
+from temporalio.client import Interceptor as ClientInterceptor, OutboundInterceptor, StartWorkflowInput, WorkflowHandle
+from temporalio.worker import (
+    ActivityInboundInterceptor,
+    ExecuteActivityInput,
+    ExecuteWorkflowInput,
+    HandleSignalInput,
+    Interceptor as WorkerInterceptor,
+    WorkflowInboundInterceptor,
+    WorkflowInterceptorClassInput,
+)
+
+from shared.logging_config import bind_temporal_context, temporal_context_var
+
+
+class TemporalContextInterceptor(ClientInterceptor, WorkerInterceptor):
+    """Client and worker interceptor binding Temporal context for logging."""
+
+    def intercept_client(self, next: OutboundInterceptor) -> OutboundInterceptor:
+        return _ClientOutbound(next)
+
+    def intercept_activity(self, next: ActivityInboundInterceptor) -> ActivityInboundInterceptor:
+        return _ActivityInbound(next)
+
+    def workflow_interceptor_class(
+        self, input: WorkflowInterceptorClassInput
+    ) -> Optional[Type[WorkflowInboundInterceptor]]:
+        return _WorkflowInbound
+
+
+class _ClientOutbound(OutboundInterceptor):
+    async def start_workflow(self, input: StartWorkflowInput) -> WorkflowHandle[Any, Any]:
+        handle = await super().start_workflow(input)
+        # Left bound for the rest of the calling task (e.g. one HTTP request),
+        # so follow-up logs about the started workflow carry its IDs
+        temporal_context_var.set({
+            **temporal_context_var.get(),
+            "workflow_id": handle.id,
+            "run_id": handle.result_run_id,
+            "task_queue": input.task_queue,
+        })
+        return handle
+
+
+class _ActivityInbound(ActivityInboundInterceptor):
+    async def execute_activity(self, input: ExecuteActivityInput) -> Any:
+        info = activity.info()
+        with bind_temporal_context(
+            workflow_id=info.workflow_id,
+            run_id=info.workflow_run_id,
+            workflow_type=info.workflow_type,
+            activity_id=info.activity_id,
+            activity_type=info.activity_type,
+            attempt=info.attempt,
+            task_queue=info.task_queue,
+        ):
+            return await super().execute_activity(input)
+
+
+class _WorkflowInbound(WorkflowInboundInterceptor):
+    # Workflow and signal handler tasks copy this context when they are created
+    def _bind(self):
+        info = workflow.info()
+        return bind_temporal_context(
+            workflow_id=info.workflow_id,
+            run_id=info.run_id,
+            workflow_type=info.workflow_type,
+            attempt=info.attempt,
+            task_queue=info.task_queue,
+        )
+
+    async def execute_workflow(self, input: ExecuteWorkflowInput) -> Any:
+        with self._bind():
+            return await super().execute_workflow(input)
+
+    async def handle_signal(self, input: HandleSignalInput) -> None:
+        with self._bind():
+            return await super().handle_signal(input)
@@ -0,0 +1,79 @@
+# Entry point for the all-in-one deployment: the order_service API,
+# PancakeOrderWorkflow and every activity in one process, sharing one Temporal client
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+ROOT = SERVICE_DIR.parent
+# Sources of the services hosted here; this service's own shared/ takes precedence
+HOSTED_SOURCES = [
+    "order_service/src",
+    "workflow_worker/src",
+    "activity_workers/analyze_order/src",
+    "activity_workers/inventory/src",
+    "activity_workers/kitchen/src",
+    "activity_workers/notify/src",
+]
+sys.path[:0] = [str(SERVICE_DIR)] + [str(ROOT / source) for source in HOSTED_SOURCES]
+
+load_dotenv()
+
+# The workflow and all its activities live in this process: start workflows
+# eagerly on the client the worker polls with, and schedule every step on the
+# workflow's task queue so activities are dispatched eagerly too
+os.environ.setdefault("WORKFLOW_EAGER_START", "true")
+os.environ.setdefault("WORKFLOW_COLOCATED", "true")
+os.environ.setdefault("TEMPORAL_CLIENT_POOL_SIZE", "1")
+os.environ.setdefault("ADMISSION_TASK_QUEUES", "pancake-task-queue")
+
+import uvicorn
+from temporalio.client import Client
+from temporalio.worker import Worker
+
+from analyze_order import analyze_order
+from inventory_check import inventory_check
+from execute_order import execute_order
+from notify import notify
+from pancake_workflow import PancakeOrderWorkflow, NotifyCustomerWorkflow
+# Imported last: it configures logging for the process
+import api
+
+logger = api.logger
+
+
+def build_worker(client: Client) -> Worker:
+    """
+    One worker on the workflow's task queue hosting the workflows and every
+    activity. Activities scheduled on this queue by a workflow running here
+    are executed eagerly, without going through the matching service.
+    """
+    return Worker(
+        client,
+        task_queue="pancake-task-queue",
+        workflows=[PancakeOrderWorkflow, NotifyCustomerWorkflow],
+        activities=[analyze_order, inventory_check, execute_order, notify],
+    )
+
+
+async def main() -> None:
+    # Connect before serving so the worker and the API share the same client,
+    # which eager workflow start requires
+    await api.temporal.start()
+    client = await api.temporal.get_client()
+    server = uvicorn.Server(uvicorn.Config(
+        api.app,
+        host=os.getenv("ORDER_SERVICE_HOST", "0.0.0.0"),
+        port=int(os.getenv("ORDER_SERVICE_PORT", 8000)),
+    ))
+    logger.info("Starting all-in-one worker and order API")
+    async with build_worker(client):
+        await server.serve()
+    logger.info("All-in-one worker stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -37,6 +37,11 @@ echo "Building activity_workers/notify..."
 echo "****************************************************"
 docker build -t pancake-notify-worker:latest ./activity_workers/notify
 
+echo "****************************************************"
+echo "Building all_in_one..."
+echo "****************************************************"
+docker build -t pancake-all-in-one:latest -f ./all_in_one/Dockerfile .
+
 echo "****************************************************"
 echo "Building frontend..."
 echo "****************************************************"
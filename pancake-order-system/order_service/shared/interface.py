@@ -15,6 +15,16 @@ class OrderResponse(BaseModel):
     status: str
     message: str
 
+class BatchOrderRequest(BaseModel):
+    orders: list[OrderRequest] = Field(min_length=1)
+
+class BatchOrderResponse(BaseModel):
+    # One result per submitted order, in request order; status is 'accepted', 'duplicate' or 'failed'
+    results: list[OrderResponse]
+    accepted: int
+    duplicates: int
+    failed: int
+
 class IngredientItem(BaseModel):
     ingredient_name: str
     amount: float
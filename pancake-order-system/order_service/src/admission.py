@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from temporalio.api.enums.v1 import DescribeTaskQueueMode, TaskQueueType
+from temporalio.api.taskqueue.v1 import TaskQueue
+from temporalio.api.workflowservice.v1 import DescribeTaskQueueRequest
+
+from shared.metrics import metrics
+from temporal_client import TemporalClientManager
+
+logger = logging.getLogger("order_service.admission")
+
+DEFAULT_TASK_QUEUES = "pancake-task-queue,analyze-order-queue,inventory-task-queue,kitchen-task-queue"
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry-After to answer with."""
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class BacklogSampler:
+    """
+    Periodically samples the backlog of the pipeline's task queues with
+    DescribeTaskQueue (enhanced mode with stats): the approximate number of
+    tasks waiting and the age of the oldest one, summed over workflow and
+    activity tasks.
+    """
+    def __init__(self, temporal: TemporalClientManager, task_queues: List[str], interval: float = 5.0):
+        self.temporal = temporal
+        self.task_queues = task_queues
+        self.interval = interval
+        self.backlog: Dict[str, Dict[str, float]] = {}
+        self.sampled_at: Optional[float] = None
+
+    async def describe(self, task_queue: str) -> Dict[str, float]:
+        client = await self.temporal.get_client()
+        response = await client.workflow_service.describe_task_queue(DescribeTaskQueueRequest(
+            namespace=client.namespace,
+            task_queue=TaskQueue(name=task_queue),
+            api_mode=DescribeTaskQueueMode.DESCRIBE_TASK_QUEUE_MODE_ENHANCED,
+            task_queue_types=[TaskQueueType.TASK_QUEUE_TYPE_WORKFLOW, TaskQueueType.TASK_QUEUE_TYPE_ACTIVITY],
+            report_stats=True,
+        ))
+        count, age = 0, 0.0
+        for version in response.versions_info.values():
+            for type_info in version.types_info.values():
+                count += type_info.stats.approximate_backlog_count
+                age = max(age, type_info.stats.approximate_backlog_age.ToTimedelta().total_seconds())
+        return {"count": count, "age": age}
+
+    async def sample(self) -> None:
+        with metrics.timer("admission.sample"):
+            results = await asyncio.gather(
+                *(self.describe(task_queue) for task_queue in self.task_queues),
+                return_exceptions=True
+            )
+        for task_queue, result in zip(self.task_queues, results):
+            if isinstance(result, Exception):
+                metrics.counter("admission.sample_errors").inc()
+                logger.warning(f"Failed to sample backlog of {task_queue}: {result}")
+                self.backlog.pop(task_queue, None)
+            else:
+                self.backlog[task_queue] = result
+        self.sampled_at = time.monotonic()
+
+    def fresh(self) -> bool:
+        """Samples older than a few intervals are ignored, so a broken sampler fails open."""
+        return self.sampled_at is not None and time.monotonic() - self.sampled_at < 3 * self.interval
+
+    async def run(self) -> None:
+        while True:
+            await self.sample()
+            await asyncio.sleep(self.interval)
+
+
+class AdmissionController:
+    """
+    Decides at the door whether a request may start workflows.
+    Each endpoint has its own budget of workflow starts in flight; requests
+    beyond it get 429. While any sampled task queue has more than
+    `max_backlog` tasks waiting, or tasks older than `max_backlog_age`
+    seconds, new work gets 503, since it would only time out in the queue.
+    """
+    def __init__(
+        self,
+        budgets: Optional[Dict[str, int]] = None,
+        sampler: Optional[BacklogSampler] = None,
+        max_backlog: Optional[int] = None,
+        max_backlog_age: Optional[float] = None,
+        retry_after: Optional[int] = None,
+    ):
+        """
+        Args:
+            budgets (Dict[str, int]): Workflow starts in flight allowed per endpoint.
+            sampler (BacklogSampler, optional): Source of task-queue backlog samples.
+            max_backlog (int): Waiting tasks per queue above which requests are shed; 0 disables.
+            max_backlog_age (float): Age in seconds of the oldest waiting task above which requests are shed; 0 disables.
+            retry_after (int): Retry-After seconds sent with 503 responses.
+        """
+        if budgets is None:
+            budgets = {
+                "orders": int(os.getenv("ADMISSION_BUDGET_ORDERS", 200)),
+                "orders_batch": int(os.getenv("ADMISSION_BUDGET_ORDERS_BATCH", 500)),
+            }
+        if max_backlog is None:
+            max_backlog = int(os.getenv("ADMISSION_MAX_BACKLOG", 1000))
+        if max_backlog_age is None:
+            max_backlog_age = float(os.getenv("ADMISSION_MAX_BACKLOG_AGE_SECONDS", 15))
+        if retry_after is None:
+            retry_after = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 5))
+        self.budgets = budgets
+        self.sampler = sampler
+        self.max_backlog = max_backlog
+        self.max_backlog_age = max_backlog_age
+        self.retry_after = retry_after
+        self.in_flight: Dict[str, int] = {endpoint: 0 for endpoint in budgets}
+
+    def _overloaded_queue(self) -> Optional[str]:
+        if self.sampler is None or not self.sampler.fresh():
+            return None
+        for task_queue, backlog in self.sampler.backlog.items():
+            if self.max_backlog and backlog["count"] > self.max_backlog:
+                return f"{task_queue} has {backlog['count']} tasks waiting"
+            if self.max_backlog_age and backlog["age"] > self.max_backlog_age:
+                return f"{task_queue} has tasks waiting for {backlog['age']:.0f}s"
+        return None
+
+    @contextmanager
+    def admit(self, endpoint: str, cost: int = 1) -> Iterator[None]:
+        """
+        Hold `cost` workflow starts of the endpoint's budget for the duration of the block.
+        Raises:
+            Overloaded: With 503 while the pipeline is backlogged, or 429 when the budget is used up.
+        """
+        if cost <= 0:
+            yield
+            return
+        overloaded = self._overloaded_queue()
+        if overloaded:
+            metrics.counter(f"admission.shed.{endpoint}").inc()
+            raise Overloaded(503, self.retry_after, f"Kitchen is backed up: {overloaded}")
+        budget = self.budgets[endpoint]
+        # A request larger than the whole budget is admitted only when the endpoint is idle
+        cost = min(cost, budget)
+        if self.in_flight[endpoint] + cost > budget:
+            metrics.counter(f"admission.throttled.{endpoint}").inc()
+            raise Overloaded(429, 1, f"Too many orders in flight on {endpoint}")
+        self.in_flight[endpoint] += cost
+        try:
+            yield
+        finally:
+            self.in_flight[endpoint] -= cost
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "in_flight": dict(self.in_flight),
+            "budgets": dict(self.budgets),
+            "backlog": dict(self.sampler.backlog) if self.sampler is not None else {},
+            "backlog_fresh": self.sampler.fresh() if self.sampler is not None else False,
+        }
@@ -1,25 +1,78 @@
-from fastapi import FastAPI, HTTPException
+from collections import Counter
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from shared.interface import OrderRequest, OrderResponse
-from shared.logging_config import setup_logging, log_with_temporal_context
-from temporalio.client import Client
-from temporalio.contrib.pydantic import pydantic_data_converter
+from fastapi.responses import JSONResponse
+from shared.interface import OrderRequest, OrderResponse, BatchOrderRequest, BatchOrderResponse
+from shared.logging_config import setup_logging, log_with_temporal_context, lazy_json
+from shared.metrics import metrics
+from temporal_client import TemporalClientManager
+from temporalio.common import WorkflowIDReusePolicy
+from temporalio.exceptions import WorkflowAlreadyStartedError
+from idempotency import IdempotencyStore
+from ratelimit import RateLimiter, RateLimited
+from admission import AdmissionController, BacklogSampler, Overloaded, DEFAULT_TASK_QUEUES
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
 import os
 import json
 from dotenv import load_dotenv
-from shared.event_publisher import EventPublisher
-import asyncio
+from shared.event_publisher import get_event_publisher, close_event_publisher
 
 load_dotenv()
 
 REDIS_CHANNEL = os.getenv("REDIS_CHANNEL", "orders")
+# Most orders accepted by one POST /orders/batch request
+ORDER_BATCH_MAX_SIZE = int(os.getenv("ORDER_BATCH_MAX_SIZE", 500))
+# Workflow starts in flight at once for one batch
+ORDER_BATCH_CONCURRENCY = int(os.getenv("ORDER_BATCH_CONCURRENCY", 20))
+# Workflow options passed to every PancakeOrderWorkflow run (see workflow_worker/README.md)
+WORKFLOW_NOTIFY_MODE = os.getenv("WORKFLOW_NOTIFY_MODE", "detached")
+WORKFLOW_LOCAL_STEPS = [s.strip() for s in os.getenv("WORKFLOW_LOCAL_STEPS", "").split(",") if s.strip()]
+WORKFLOW_COLOCATED = os.getenv("WORKFLOW_COLOCATED", "false").lower() == "true"
+# Hand new workflows straight to a worker in this process (all_in_one) instead of through matching
+WORKFLOW_EAGER_START = os.getenv("WORKFLOW_EAGER_START", "false").lower() == "true"
 
 logger = setup_logging("order_service")
 
+# Process-wide Temporal client pool shared by all requests
+temporal = TemporalClientManager()
+# Original responses of accepted orders, so client retries skip Temporal
+idempotency = IdempotencyStore(os.getenv("REDIS_ADDRESS", "redis://localhost:6379"))
+# Sheds new orders while the pipeline's task queues are backed up
+backlog_sampler = BacklogSampler(
+    temporal,
+    [q.strip() for q in os.getenv("ADMISSION_TASK_QUEUES", DEFAULT_TASK_QUEUES).split(",") if q.strip()],
+    float(os.getenv("ADMISSION_SAMPLE_INTERVAL_SECONDS", 5))
+)
+admission = AdmissionController(sampler=backlog_sampler)
+# Per-caller token buckets shared by all replicas through Redis
+rate_limiter = RateLimiter(
+    os.getenv("REDIS_ADDRESS", "redis://localhost:6379")
+    if os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true" else None
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await temporal.start()
+    sampler_task = asyncio.create_task(backlog_sampler.run()) if backlog_sampler.task_queues else None
+    yield
+    if sampler_task is not None:
+        sampler_task.cancel()
+        try:
+            await sampler_task
+        except asyncio.CancelledError:
+            pass
+    await close_event_publisher()
+    await idempotency.close()
+    await rate_limiter.close()
+    await temporal.close()
+
 app = FastAPI(
     title="Pancake Order Service",
     description="API for managing pancake orders with AI-powered ingredient analysis",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -36,90 +89,268 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    log_with_temporal_context(
+        logger,
+        "warning",
+        f"Shedding {request.url.path} with {exc.status_code}: {exc.reason}"
+    )
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    log_with_temporal_context(
+        logger,
+        "warning",
+        f"Rate limited {request.url.path}: {exc}"
+    )
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers=exc.headers)
+
+def rate_limit_key(order: OrderRequest, api_key: Optional[str]) -> str:
+    """Integrations are limited by API key; callers without one by customer name."""
+    return f"key:{api_key}" if api_key else f"customer:{order.customer_name}"
+
+def received_event(order: OrderRequest) -> dict:
+    return {
+        "status": "received",
+        "message": "Order has been received and is being processed.",
+        "order_id": str(order.order_id),
+    }
+
+def workflow_id_for(order: OrderRequest) -> str:
+    return f"pancake-workflow-{order.order_id}"
+
+def accepted_response(order: OrderRequest) -> OrderResponse:
+    return OrderResponse(
+        order_id=order.order_id,
+        workflow_id=workflow_id_for(order),
+        status="accepted",
+        message="Order accepted and workflow started"
+    )
+
+async def start_order_workflow(order: OrderRequest) -> None:
+    # REJECT_DUPLICATE keeps even a finished order from being run again
+    await temporal.start_workflow(
+        "PancakeOrderWorkflow",
+        args=[
+            order.order_id,
+            order,
+            WORKFLOW_NOTIFY_MODE,
+            WORKFLOW_LOCAL_STEPS,
+            WORKFLOW_COLOCATED
+        ],
+        id=workflow_id_for(order),
+        task_queue="pancake-task-queue",
+        id_reuse_policy=WorkflowIDReusePolicy.REJECT_DUPLICATE,
+        request_eager_start=WORKFLOW_EAGER_START
+    )
+
 @app.post("/orders", response_model=OrderResponse)
-async def create_order(order: OrderRequest):
-    try:
-        # Publish event to Redis
-        publisher = EventPublisher()
-        event_message = {
-            "status": "received",
-            "message": "Order has been received and is being processed.",
-            "order_id": str(order.order_id),
-        }
-        asyncio.create_task(publisher.publish_event(REDIS_CHANNEL, event_message))
-        
+async def create_order(
+    order: OrderRequest,
+    response: Response,
+    x_api_key: Optional[str] = Header(None)
+):
+    # Retries of an accepted order get the original response without a Temporal call
+    original = await idempotency.get(order.order_id)
+    if original is not None:
         log_with_temporal_context(
             logger,
             "info",
-            f"Received new order request: {order.model_dump_json(indent=2)}"
+            f"Returning original response for repeated order {order.order_id}"
         )
-        # Connect to Temporal
-        temporal_server = os.getenv("TEMPORAL_ADDRESS")
-        log_with_temporal_context(
-            logger,
-            "info",
-            f"Connecting to Temporal server at {temporal_server}"
-        )
-        client = await Client.connect(
-            temporal_server,
-            data_converter=pydantic_data_converter
-        )
-        log_with_temporal_context(
-            logger,
-            "info",
-            "Successfully connected to Temporal server"
-        )
-        # Generate workflow ID
-        workflow_id = f"pancake-workflow-{order.order_id}"
-        log_with_temporal_context(
-            logger,
-            "info",
-            f"Generated workflow ID: {workflow_id}"
-        )
-        # Start the workflow
-        log_with_temporal_context(
-            logger,
-            "info",
-            f"Starting workflow with ID: {workflow_id}"
-        )
-        handle = await client.start_workflow(
-            "PancakeOrderWorkflow",
-            args=[
-                order.order_id,
-                order
-            ],
-            id=workflow_id,
-            task_queue="pancake-task-queue"
-        )
-        log_with_temporal_context(
-            logger,
-            "info",
-            f"Successfully started workflow with ID: {workflow_id}"
+        return original
+    quota = await rate_limiter.acquire(rate_limit_key(order, x_api_key))
+    if quota is not None:
+        response.headers.update(quota.headers())
+    with admission.admit("orders"):
+        if not await idempotency.claim(order.order_id):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Order {order.order_id} is already being processed"
+            )
+        try:
+            # Publish event to Redis
+            publisher = get_event_publisher()
+            await publisher.publish_event(REDIS_CHANNEL, received_event(order))
+        
+            log_with_temporal_context(
+                logger,
+                "info",
+                "Received new order request",
+                order=lazy_json(order)
+            )
+            # Generate workflow ID
+            workflow_id = workflow_id_for(order)
+            log_with_temporal_context(
+                logger,
+                "info",
+                f"Generated workflow ID: {workflow_id}"
+            )
+            # Start the workflow
+            log_with_temporal_context(
+                logger,
+                "info",
+                f"Starting workflow with ID: {workflow_id}"
+            )
+            try:
+                await start_order_workflow(order)
+                log_with_temporal_context(
+                    logger,
+                    "info",
+                    f"Successfully started workflow with ID: {workflow_id}"
+                )
+            except WorkflowAlreadyStartedError:
+                # Accepted earlier but no longer remembered (e.g. expired key): the same response applies
+                log_with_temporal_context(
+                    logger,
+                    "info",
+                    f"Workflow {workflow_id} was already started"
+                )
+            accepted = accepted_response(order)
+            await idempotency.complete(accepted)
+            log_with_temporal_context(
+                logger,
+                "info",
+                f"Returning response for order {order.order_id}",
+                response=lazy_json(accepted)
+            )
+            return accepted
+        except Exception as e:
+            await idempotency.release(order.order_id)
+            log_with_temporal_context(
+                logger,
+                "error",
+                f"Error processing order: {str(e)}",
+                error=str(e)
+            )
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to process order: {str(e)}"
+            )
+
+@app.post("/orders/batch", response_model=BatchOrderResponse)
+async def create_orders_batch(
+    batch: BatchOrderRequest,
+    response: Response,
+    x_api_key: Optional[str] = Header(None)
+):
+    if len(batch.orders) > ORDER_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A batch may contain at most {ORDER_BATCH_MAX_SIZE} orders"
         )
-        response = OrderResponse(
+    results: List[Optional[OrderResponse]] = [None] * len(batch.orders)
+
+    def duplicate(index: int, order: OrderRequest, message: str) -> None:
+        results[index] = OrderResponse(
             order_id=order.order_id,
-            workflow_id=workflow_id,
-            status="accepted",
-            message="Order accepted and workflow started"
-        )
-        log_with_temporal_context(
-            logger,
-            "info",
-            f"Returning response for order {order.order_id}: {response.model_dump_json(indent=2)}"
-        )
-        return response
-    except Exception as e:
-        log_with_temporal_context(
-            logger,
-            "error",
-            f"Error processing order: {str(e)}",
-            error=str(e)
-        )
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to process order: {str(e)}"
+            workflow_id=workflow_id_for(order),
+            status="duplicate",
+            message=message
         )
 
+    unique = []
+    seen = set()
+    for index, order in enumerate(batch.orders):
+        if order.order_id in seen:
+            duplicate(index, order, "Order appears earlier in this batch")
+        else:
+            seen.add(order.order_id)
+            unique.append((index, order))
+    originals = await idempotency.get_many([order.order_id for _, order in unique])
+    fresh = []
+    for index, order in unique:
+        if originals[order.order_id] is not None:
+            duplicate(index, order, "Order was already accepted")
+        else:
+            fresh.append((index, order))
+    # Each caller is charged one token per new order; a batch is charged all or nothing
+    costs = Counter(rate_limit_key(order, x_api_key) for _, order in fresh)
+    quotas = await rate_limiter.acquire_many(costs)
+    if len(quotas) == 1:
+        quota = next(iter(quotas.values()))
+        if quota is not None:
+            response.headers.update(quota.headers())
+    # Only orders that will actually start a workflow count against the budget
+    with admission.admit("orders_batch", cost=len(fresh)):
+        claims = await idempotency.claim_many([order.order_id for _, order in fresh])
+        pending = []
+        for index, order in fresh:
+            if claims[order.order_id]:
+                pending.append((index, order))
+            else:
+                duplicate(index, order, "Order is already being processed")
+        try:
+            # All "received" events go out together in one pipelined flush
+            await get_event_publisher().publish_events(REDIS_CHANNEL, [received_event(order) for _, order in pending])
+        except Exception as e:
+            await idempotency.release_many([order.order_id for _, order in pending])
+            log_with_temporal_context(
+                logger,
+                "error",
+                f"Error publishing batch events: {str(e)}",
+                error=str(e)
+            )
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to process batch: {str(e)}"
+            )
+
+        semaphore = asyncio.Semaphore(ORDER_BATCH_CONCURRENCY)
+        completed: List[OrderResponse] = []
+        failed: List[str] = []
+
+        async def start(index: int, order: OrderRequest) -> None:
+            workflow_id = workflow_id_for(order)
+            async with semaphore:
+                try:
+                    await start_order_workflow(order)
+                    status, message = "accepted", "Order accepted and workflow started"
+                except WorkflowAlreadyStartedError:
+                    status, message = "duplicate", "A workflow for this order is already running"
+                except Exception as e:
+                    log_with_temporal_context(
+                        logger,
+                        "error",
+                        f"Error starting workflow {workflow_id}: {str(e)}",
+                        error=str(e)
+                    )
+                    status, message = "failed", f"Failed to start workflow: {str(e)}"
+            if status == "failed":
+                failed.append(order.order_id)
+            else:
+                # Retries of this order, single or batched, are answered from the idempotency store
+                completed.append(accepted_response(order))
+            results[index] = OrderResponse(
+                order_id=order.order_id,
+                workflow_id=workflow_id,
+                status=status,
+                message=message
+            )
+
+        await asyncio.gather(*(start(index, order) for index, order in pending))
+        await idempotency.complete_many(completed)
+        await idempotency.release_many(failed)
+    summary = BatchOrderResponse(
+        results=results,
+        accepted=sum(r.status == "accepted" for r in results),
+        duplicates=sum(r.status == "duplicate" for r in results),
+        failed=sum(r.status == "failed" for r in results)
+    )
+    log_with_temporal_context(
+        logger,
+        "info",
+        f"Processed batch of {len(results)} orders: {summary.accepted} accepted, "
+        f"{summary.duplicates} duplicate, {summary.failed} failed"
+    )
+    return summary
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     log_with_temporal_context(
@@ -127,4 +358,12 @@ async def health_check():
         "info",
         "Health check requested"
     )
-    return {"status": "healthy"} 
\ No newline at end of file
+    temporal_health = temporal.health()
+    return {
+        "status": "healthy" if temporal_health["healthy"] else "degraded",
+        "temporal": temporal_health
+    }
+
+@app.get("/metrics", tags=["Health"])
+async def get_metrics():
+    return {**metrics.snapshot(), "admission": admission.snapshot()}
@@ -0,0 +1,167 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+import redis.asyncio as aioredis
+
+from shared.interface import OrderResponse
+from shared.metrics import metrics
+
+logger = logging.getLogger("order_service.idempotency")
+
+# Value stored while the first request for an order is still starting its workflow
+PENDING = "pending"
+
+
+class IdempotencyStore:
+    """
+    Remembers the OrderResponse returned for each accepted order_id, so retried
+    requests get the original response back without contacting Temporal.
+    Responses are cached in an in-process LRU in front of Redis keys shared by
+    all replicas. A request claims an order with SET NX before starting its
+    workflow; concurrent retries see the claim and back off. If Redis is
+    unavailable the store degrades to the local cache, and Temporal's workflow
+    ID reuse policy remains the final guard against duplicate starts.
+    """
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        ttl: Optional[int] = None,
+        pending_ttl: Optional[int] = None,
+        cache_size: Optional[int] = None,
+        key_prefix: str = "order_idempotency:",
+    ):
+        """
+        Args:
+            redis_url (str, optional): Redis URL; None keeps everything in process.
+            ttl (int): Seconds a response is remembered.
+            pending_ttl (int): Seconds a claim lasts if its request never completes.
+            cache_size (int): Responses kept in the in-process LRU.
+            key_prefix (str): Prefix of the Redis keys.
+        """
+        if ttl is None:
+            ttl = int(os.getenv("ORDER_IDEMPOTENCY_TTL", 86400))
+        if pending_ttl is None:
+            pending_ttl = int(os.getenv("ORDER_IDEMPOTENCY_PENDING_TTL", 30))
+        if cache_size is None:
+            cache_size = int(os.getenv("ORDER_IDEMPOTENCY_CACHE_SIZE", 10000))
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.cache_size = cache_size
+        self.key_prefix = key_prefix
+        self._cache: "OrderedDict[str, OrderResponse]" = OrderedDict()
+        self._claimed: Set[str] = set()
+        self._redis: Optional[aioredis.Redis] = None
+
+    def _client(self) -> Optional[aioredis.Redis]:
+        if self._redis is None and self.redis_url:
+            self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+        return self._redis
+
+    def _remember_locally(self, response: OrderResponse) -> None:
+        self._cache[response.order_id] = response
+        self._cache.move_to_end(response.order_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def get_many(self, order_ids: Iterable[str]) -> Dict[str, Optional[OrderResponse]]:
+        """
+        Look up the responses already returned for several orders.
+        Returns:
+            A dict from order_id to its original response, or None if it was never accepted.
+        """
+        result: Dict[str, Optional[OrderResponse]] = {}
+        missing = []
+        for order_id in order_ids:
+            cached = self._cache.get(order_id)
+            if cached is not None:
+                self._cache.move_to_end(order_id)
+                metrics.counter("idempotency.local_hits").inc()
+            else:
+                missing.append(order_id)
+            result[order_id] = cached
+        r = self._client()
+        if missing and r is not None:
+            try:
+                values = await r.mget([self.key_prefix + order_id for order_id in missing])
+            except Exception as e:
+                metrics.counter("idempotency.redis_errors").inc()
+                logger.error(f"Idempotency lookup failed: {e}")
+                values = [None] * len(missing)
+            for order_id, value in zip(missing, values):
+                if value and value != PENDING:
+                    response = OrderResponse.model_validate_json(value)
+                    self._remember_locally(response)
+                    result[order_id] = response
+                    metrics.counter("idempotency.redis_hits").inc()
+        return result
+
+    async def get(self, order_id: str) -> Optional[OrderResponse]:
+        return (await self.get_many([order_id]))[order_id]
+
+    async def claim_many(self, order_ids: List[str]) -> Dict[str, bool]:
+        """
+        Claim orders before starting their workflows.
+        Returns:
+            A dict from order_id to True if this request owns the order, False if
+            another request already claimed or completed it.
+        """
+        claims = {order_id: order_id not in self._claimed for order_id in order_ids}
+        to_claim = [order_id for order_id, ok in claims.items() if ok]
+        r = self._client()
+        if to_claim and r is not None:
+            try:
+                async with r.pipeline(transaction=False) as pipe:
+                    for order_id in to_claim:
+                        pipe.set(self.key_prefix + order_id, PENDING, nx=True, ex=self.pending_ttl)
+                    results = await pipe.execute()
+                for order_id, ok in zip(to_claim, results):
+                    claims[order_id] = bool(ok)
+            except Exception as e:
+                metrics.counter("idempotency.redis_errors").inc()
+                logger.error(f"Idempotency claim failed, relying on Temporal's ID reuse policy: {e}")
+        self._claimed.update(order_id for order_id, ok in claims.items() if ok)
+        return claims
+
+    async def claim(self, order_id: str) -> bool:
+        return (await self.claim_many([order_id]))[order_id]
+
+    async def complete_many(self, responses: List[OrderResponse]) -> None:
+        """Store the responses of claimed orders so retries get them back."""
+        for response in responses:
+            self._remember_locally(response)
+            self._claimed.discard(response.order_id)
+        r = self._client()
+        if responses and r is not None:
+            try:
+                async with r.pipeline(transaction=False) as pipe:
+                    for response in responses:
+                        pipe.set(self.key_prefix + response.order_id, response.model_dump_json(), ex=self.ttl)
+                    await pipe.execute()
+            except Exception as e:
+                metrics.counter("idempotency.redis_errors").inc()
+                logger.error(f"Failed to store idempotency keys: {e}")
+
+    async def complete(self, response: OrderResponse) -> None:
+        await self.complete_many([response])
+
+    async def release_many(self, order_ids: List[str]) -> None:
+        """Drop claims of orders whose workflow failed to start, so they can be retried."""
+        self._claimed.difference_update(order_ids)
+        r = self._client()
+        if order_ids and r is not None:
+            try:
+                await r.delete(*(self.key_prefix + order_id for order_id in order_ids))
+            except Exception as e:
+                metrics.counter("idempotency.redis_errors").inc()
+                logger.error(f"Failed to release idempotency keys: {e}")
+
+    async def release(self, order_id: str) -> None:
+        await self.release_many([order_id])
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
@@ -0,0 +1,236 @@
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import redis.asyncio as aioredis
+
+from shared.metrics import metrics
+
+logger = logging.getLogger("order_service.ratelimit")
+
+# Token bucket refilled continuously at ARGV[2] tokens/s up to ARGV[1]. Grants up
+# to ARGV[3] tokens, but only if at least ARGV[4] are available. Uses the Redis
+# clock so all replicas agree on time.
+# Returns {granted, tokens left (floored), ms until ARGV[4] tokens are available}.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local minimum = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local granted = 0
+if tokens >= minimum then
+    granted = math.min(requested, math.floor(tokens))
+    tokens = tokens - granted
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+local wait_ms = 0
+if granted == 0 then
+    wait_ms = math.ceil((minimum - tokens) / rate * 1000)
+end
+return {granted, math.floor(tokens), wait_ms}
+"""
+
+# Gives ARGV[2] tokens back to a bucket, up to its capacity ARGV[1]
+REFUND_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + tonumber(ARGV[2]))))
+end
+return 0
+"""
+
+
+class RateLimited(Exception):
+    """Raised when a caller has used up its bucket; carries the headers to answer 429 with."""
+    def __init__(self, key: str, headers: Dict[str, str], message: Optional[str] = None):
+        super().__init__(message or f"Rate limit exceeded for {key}")
+        self.key = key
+        self.headers = headers
+
+
+@dataclass
+class Quota:
+    limit: int
+    remaining: int
+    reset: float  # Seconds until the bucket is full again
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(self.remaining, 0)),
+            "X-RateLimit-Reset": str(math.ceil(self.reset)),
+        }
+
+
+@dataclass
+class _LocalState:
+    tokens: int = 0
+    lease_expires: float = 0.0
+    denied_until: float = 0.0
+    remaining: int = 0
+    last_seen: float = 0.0
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limits per caller (API key or customer), enforced in
+    Redis by a Lua script so every order_service replica draws from the same
+    budget.
+    Hot keys take a fast path that avoids a Redis round-trip per request. A key
+    seen again within a second leases a few tokens at once and spends them
+    locally; leases expire after a second, so unused tokens are forfeited
+    rather than over-granted. A denied key is refused locally until Redis said
+    its next token would be available.
+    """
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        capacity: Optional[int] = None,
+        refill_per_second: Optional[float] = None,
+        lease_size: Optional[int] = None,
+        key_prefix: str = "ratelimit:",
+    ):
+        """
+        Args:
+            redis_url (str, optional): Redis URL; None disables rate limiting.
+            capacity (int): Bucket size, i.e. the largest burst a caller may send.
+            refill_per_second (float): Sustained requests per second per caller.
+            lease_size (int): Tokens leased at once for hot keys; 1 disables leasing.
+            key_prefix (str): Prefix of the Redis bucket keys.
+        """
+        if capacity is None:
+            capacity = int(os.getenv("RATE_LIMIT_CAPACITY", 20))
+        if refill_per_second is None:
+            refill_per_second = float(os.getenv("RATE_LIMIT_REFILL_PER_SECOND", 1))
+        if lease_size is None:
+            lease_size = int(os.getenv("RATE_LIMIT_LOCAL_LEASE", 5))
+        self.redis_url = redis_url
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.lease_size = max(1, lease_size)
+        self.key_prefix = key_prefix
+        self._local: Dict[str, _LocalState] = {}
+        self._redis: Optional[aioredis.Redis] = None
+        self._script = None
+        self._refund_script = None
+
+    def _client(self) -> Optional[aioredis.Redis]:
+        if self._redis is None and self.redis_url:
+            self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+            self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+            self._refund_script = self._redis.register_script(REFUND_SCRIPT)
+        return self._redis
+
+    def _reset_after(self, remaining: int) -> float:
+        return (self.capacity - remaining) / self.refill_per_second
+
+    async def acquire(self, key: str, cost: int = 1) -> Optional[Quota]:
+        """
+        Take `cost` tokens from the caller's bucket.
+        Returns:
+            The caller's quota after this request, or None when rate limiting is disabled.
+        Raises:
+            RateLimited: If the bucket does not hold `cost` tokens, or `cost`
+                exceeds the bucket's capacity.
+        """
+        if self._client() is None:
+            return None
+        if cost > self.capacity:
+            # Could never be granted; refuse instead of undercharging
+            metrics.counter("ratelimit.denied").inc()
+            raise RateLimited(
+                key,
+                Quota(self.capacity, 0, self._reset_after(0)).headers(),
+                f"Request costs {cost} tokens, more than the limit of {self.capacity} for {key}"
+            )
+        now = time.monotonic()
+        state = self._local.get(key)
+        if state is None:
+            # Bounded by the number of callers seen recently; prune the idle ones
+            if len(self._local) > 10000:
+                self._local = {k: s for k, s in self._local.items() if now - s.last_seen < 60}
+            state = self._local[key] = _LocalState()
+        hot = now - state.last_seen < 1.0
+        state.last_seen = now
+
+        if now < state.denied_until:
+            metrics.counter("ratelimit.local_denied").inc()
+            raise self._denied(key, state.denied_until - now)
+        if state.tokens >= cost and now < state.lease_expires:
+            state.tokens -= cost
+            metrics.counter("ratelimit.local_hits").inc()
+            return Quota(self.capacity, state.remaining + state.tokens, self._reset_after(state.remaining))
+
+        requested = max(cost, self.lease_size) if hot else cost
+        try:
+            granted, remaining, wait_ms = await self._script(
+                keys=[self.key_prefix + key],
+                args=[self.capacity, self.refill_per_second, requested, cost]
+            )
+        except Exception as e:
+            # Fail open: a Redis outage must not stop order intake
+            metrics.counter("ratelimit.redis_errors").inc()
+            logger.error(f"Rate limit check failed for {key}: {e}")
+            return None
+        if not granted:
+            state.tokens = 0
+            state.denied_until = now + wait_ms / 1000
+            metrics.counter("ratelimit.denied").inc()
+            raise self._denied(key, wait_ms / 1000)
+        state.tokens = granted - min(cost, granted)
+        state.lease_expires = now + 1.0
+        state.remaining = remaining
+        return Quota(self.capacity, remaining + state.tokens, self._reset_after(remaining))
+
+    async def acquire_many(self, costs: Dict[str, int]) -> Dict[str, Optional[Quota]]:
+        """
+        Take tokens from several callers' buckets, all or nothing.
+        Args:
+            costs: Tokens to take per caller key.
+        Returns:
+            Each caller's quota after this request (None when rate limiting is disabled).
+        Raises:
+            RateLimited: If any bucket is short; tokens already taken from the
+                other buckets are given back.
+        """
+        quotas: Dict[str, Optional[Quota]] = {}
+        try:
+            for key, cost in costs.items():
+                quotas[key] = await self.acquire(key, cost)
+        except RateLimited:
+            for key in quotas:
+                await self.refund(key, costs[key])
+            raise
+        return quotas
+
+    async def refund(self, key: str, tokens: int) -> None:
+        """Give back tokens taken for a request that was not carried out."""
+        if self._client() is None:
+            return
+        try:
+            await self._refund_script(keys=[self.key_prefix + key], args=[self.capacity, tokens])
+        except Exception as e:
+            metrics.counter("ratelimit.redis_errors").inc()
+            logger.error(f"Rate limit refund failed for {key}: {e}")
+
+    def _denied(self, key: str, retry_after: float) -> RateLimited:
+        headers = Quota(self.capacity, 0, self._reset_after(0)).headers()
+        headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        return RateLimited(key, headers)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+            self._script = None
+            self._refund_script = None
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from temporalio.client import Client, WorkflowHandle
+from temporalio.contrib.pydantic import pydantic_data_converter
+from temporalio.service import RPCError, RPCStatusCode
+
+from shared.metrics import metrics
+from shared.temporal_context import TemporalContextInterceptor
+
+logger = logging.getLogger("order_service.temporal_client")
+
+# Status codes that mean the channel itself is unusable and should be rebuilt
+RECONNECT_STATUS_CODES = {RPCStatusCode.UNAVAILABLE, RPCStatusCode.UNKNOWN}
+
+
+class TemporalClientManager:
+    """
+    Owns the Temporal clients shared by every request in the process.
+    Clients are created once at startup (or lazily on first use), handed out
+    round-robin from a bounded pool and rebuilt when the connection breaks.
+    """
+    def __init__(
+        self,
+        target_host: str = None,
+        pool_size: int = None,
+        reconnect_backoff: float = None,
+    ):
+        """
+        Args:
+            target_host (str): Temporal frontend address (default: TEMPORAL_ADDRESS).
+            pool_size (int): Number of independent client connections (default: TEMPORAL_CLIENT_POOL_SIZE or 1).
+            reconnect_backoff (float): Minimum seconds between connect attempts for a pool slot.
+        """
+        if target_host is None:
+            target_host = os.getenv("TEMPORAL_ADDRESS", "localhost:7233")
+        if pool_size is None:
+            pool_size = int(os.getenv("TEMPORAL_CLIENT_POOL_SIZE", 1))
+        if reconnect_backoff is None:
+            reconnect_backoff = float(os.getenv("TEMPORAL_RECONNECT_BACKOFF_SECONDS", 1.0))
+        self.target_host = target_host
+        self.pool_size = max(1, pool_size)
+        self.reconnect_backoff = reconnect_backoff
+        self._clients: List[Optional[Client]] = [None] * self.pool_size
+        self._locks = [asyncio.Lock() for _ in range(self.pool_size)]
+        self._last_attempt = [0.0] * self.pool_size
+        self._next_slot = itertools.cycle(range(self.pool_size))
+        self.last_error: Optional[str] = None
+        self.last_connected_at: Optional[float] = None
+        self.connect_failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        """True when at least one pool slot holds a connected client."""
+        return any(c is not None for c in self._clients)
+
+    async def start(self) -> None:
+        """Connect every pool slot. Failures are logged and retried lazily on first use."""
+        logger.info(f"Connecting {self.pool_size} Temporal client(s) to {self.target_host}")
+        results = await asyncio.gather(
+            *(self._connect_slot(slot) for slot in range(self.pool_size)),
+            return_exceptions=True
+        )
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logger.warning(f"{len(failed)} of {self.pool_size} Temporal client(s) failed to connect; will retry on demand")
+
+    async def close(self) -> None:
+        """Drop all clients. The underlying channels are released once unreferenced."""
+        self._clients = [None] * self.pool_size
+        logger.info("Temporal client pool closed")
+
+    async def _connect_slot(self, slot: int) -> Client:
+        async with self._locks[slot]:
+            client = self._clients[slot]
+            if client is not None:
+                return client
+            since_last = time.monotonic() - self._last_attempt[slot]
+            if since_last < self.reconnect_backoff:
+                raise RuntimeError(
+                    f"Temporal client unavailable (last error: {self.last_error}); "
+                    f"retrying in {self.reconnect_backoff - since_last:.1f}s"
+                )
+            self._last_attempt[slot] = time.monotonic()
+            try:
+                with metrics.timer("temporal.connect"):
+                    client = await Client.connect(
+                        self.target_host,
+                        data_converter=pydantic_data_converter,
+                        interceptors=[TemporalContextInterceptor()]
+                    )
+            except Exception as e:
+                self.connect_failures += 1
+                self.last_error = str(e)
+                metrics.counter("temporal.connect_failures").inc()
+                logger.error(f"Failed to connect Temporal client slot {slot}: {e}")
+                raise
+            self._clients[slot] = client
+            self.last_connected_at = time.time()
+            self.last_error = None
+            logger.info(f"Temporal client slot {slot} connected to {self.target_host}")
+            return client
+
+    async def get_client(self) -> Client:
+        """Return the next pooled client, reconnecting its slot if needed."""
+        slot = next(self._next_slot)
+        client = self._clients[slot]
+        if client is None:
+            client = await self._connect_slot(slot)
+        return client
+
+    def invalidate(self, client: Client, error: Exception) -> None:
+        """Drop a client whose connection is broken so the next request rebuilds it."""
+        for slot, existing in enumerate(self._clients):
+            if existing is client:
+                self._clients[slot] = None
+                self.last_error = str(error)
+                metrics.counter("temporal.reconnects").inc()
+                logger.warning(f"Temporal client slot {slot} invalidated: {error}")
+
+    async def start_workflow(self, workflow: str, **kwargs: Any) -> WorkflowHandle:
+        """
+        Start a workflow on a pooled client, recording start latency.
+        Args:
+            workflow (str): Workflow type name.
+            **kwargs: Passed through to Client.start_workflow.
+        """
+        client = await self.get_client()
+        try:
+            with metrics.timer("temporal.start_workflow"):
+                return await client.start_workflow(workflow, **kwargs)
+        except RPCError as e:
+            if e.status in RECONNECT_STATUS_CODES:
+                self.invalidate(client, e)
+            raise
+
+    def health(self) -> Dict[str, Any]:
+        """Summarize pool state for the health endpoint."""
+        return {
+            "healthy": self.healthy,
+            "target": self.target_host,
+            "pool_size": self.pool_size,
+            "connected": sum(1 for c in self._clients if c is not None),
+            "connect_failures": self.connect_failures,
+            "last_error": self.last_error,
+            "last_connected_at": self.last_connected_at,
+        }
@@ -1 +1,361 @@
-# Placeholder for order_service API unit tests 
\ No newline at end of file
+# Unit tests for the order_service API: intake, batches, idempotency, rate limiting, admission and the Temporal client pool
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from temporalio.exceptions import WorkflowAlreadyStartedError
+
+import api
+import temporal_client
+from idempotency import IdempotencyStore
+from admission import AdmissionController, BacklogSampler
+from ratelimit import RateLimiter
+from shared.interface import OrderResponse
+
+
+class FakeHandle:
+    def __init__(self, workflow_id):
+        self.id = workflow_id
+
+
+class FakeTemporalClient:
+    running = set()
+    starts = []
+    in_flight = 0
+    max_in_flight = 0
+
+    def __init__(self):
+        self.started = []
+
+    async def start_workflow(self, workflow, **kwargs):
+        workflow_id = kwargs["id"]
+        if workflow_id.endswith("-fail"):
+            raise RuntimeError("start failed")
+        if workflow_id in FakeTemporalClient.running:
+            raise WorkflowAlreadyStartedError(workflow_id, workflow)
+        FakeTemporalClient.in_flight += 1
+        FakeTemporalClient.max_in_flight = max(FakeTemporalClient.max_in_flight, FakeTemporalClient.in_flight)
+        await asyncio.sleep(0.001)
+        FakeTemporalClient.in_flight -= 1
+        FakeTemporalClient.running.add(workflow_id)
+        FakeTemporalClient.starts.append(kwargs)
+        self.started.append((workflow, kwargs))
+        return FakeHandle(workflow_id)
+
+
+class FakePublisher:
+    published = []
+
+    async def publish_event(self, channel, message):
+        FakePublisher.published.append((channel, message))
+
+    async def publish_events(self, channel, messages):
+        FakePublisher.published.append((channel, messages))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    connects = []
+
+    async def fake_connect(target_host, **kwargs):
+        connects.append(target_host)
+        return FakeTemporalClient()
+
+    FakeTemporalClient.running = set()
+    FakeTemporalClient.starts = []
+    FakeTemporalClient.max_in_flight = 0
+    FakePublisher.published = []
+    monkeypatch.setattr(temporal_client.Client, "connect", fake_connect)
+    monkeypatch.setattr(api, "get_event_publisher", FakePublisher)
+    monkeypatch.setattr(api, "temporal", temporal_client.TemporalClientManager("temporal:7233", pool_size=2))
+    monkeypatch.setattr(api, "idempotency", IdempotencyStore(None))
+    monkeypatch.setattr(api, "backlog_sampler", BacklogSampler(api.temporal, []))
+    monkeypatch.setattr(api, "rate_limiter", RateLimiter(None))
+    monkeypatch.setattr(api, "admission", AdmissionController({"orders": 5, "orders_batch": 50}, api.backlog_sampler))
+    with TestClient(api.app) as test_client:
+        test_client.connects = connects
+        yield test_client
+
+
+def order_payload(order_id):
+    return {
+        "order_id": order_id,
+        "customer_order": "Two classic pancakes",
+        "customer_name": "Alex",
+    }
+
+
+def test_temporal_clients_are_shared_across_requests(client):
+    for i in range(5):
+        resp = client.post("/orders", json=order_payload(f"order-{i}"))
+        assert resp.status_code == 200
+        assert resp.json()["workflow_id"] == f"pancake-workflow-order-{i}"
+    # One connect per pool slot at startup, none per request
+    assert client.connects == ["temporal:7233", "temporal:7233"]
+
+
+def test_batch_returns_per_order_results(client, monkeypatch):
+    monkeypatch.setattr(api, "ORDER_BATCH_CONCURRENCY", 3)
+    client.post("/orders", json=order_payload("already-running"))
+    orders = [order_payload(f"batch-{i}") for i in range(10)]
+    orders += [order_payload("batch-0"), order_payload("already-running"), order_payload("batch-fail")]
+    resp = client.post("/orders/batch", json={"orders": orders})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [r["status"] for r in body["results"][-3:]] == ["duplicate", "duplicate", "failed"]
+    assert (body["accepted"], body["duplicates"], body["failed"]) == (10, 2, 1)
+    assert FakeTemporalClient.max_in_flight <= 3
+    assert body["results"][-2]["message"] == "Order was already accepted"
+    # One grouped publish for every new order in the batch
+    channel, messages = FakePublisher.published[-1]
+    assert [m["order_id"] for m in messages][-1] == "batch-fail"
+    assert len(messages) == 11
+
+
+def test_batch_rejects_oversized_and_empty_batches(client, monkeypatch):
+    monkeypatch.setattr(api, "ORDER_BATCH_MAX_SIZE", 2)
+    orders = [order_payload(f"big-{i}") for i in range(3)]
+    assert client.post("/orders/batch", json={"orders": orders}).status_code == 413
+    assert client.post("/orders/batch", json={"orders": []}).status_code == 422
+
+
+def test_retried_order_returns_original_response_without_temporal(client):
+    first = client.post("/orders", json=order_payload("retry-1"))
+    second = client.post("/orders", json=order_payload("retry-1"))
+    assert second.status_code == 200 and second.json() == first.json()
+    assert len(FakeTemporalClient.starts) == 1
+    assert FakeTemporalClient.starts[0]["id_reuse_policy"] == api.WorkflowIDReusePolicy.REJECT_DUPLICATE
+    # The received event is only published once
+    assert [m["order_id"] for _, m in FakePublisher.published] == ["retry-1"]
+
+
+def test_already_started_workflow_is_not_an_error(client):
+    FakeTemporalClient.running.add("pancake-workflow-forgotten")
+    resp = client.post("/orders", json=order_payload("forgotten"))
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "accepted"
+
+
+def test_in_flight_order_is_rejected_and_failed_order_can_be_retried(client):
+    client.portal.call(api.idempotency.claim, "in-flight")
+    assert client.post("/orders", json=order_payload("in-flight")).status_code == 409
+    assert client.post("/orders", json=order_payload("order-fail")).status_code == 500
+    # The failed attempt released its claim, so the retry reaches Temporal again
+    assert client.post("/orders", json=order_payload("order-fail")).status_code == 500
+
+
+def test_requests_over_the_endpoint_budget_get_429(client, monkeypatch):
+    monkeypatch.setattr(api, "admission", AdmissionController({"orders": 1, "orders_batch": 1}))
+    with api.admission.admit("orders"):
+        resp = client.post("/orders", json=order_payload("busy"))
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "1"
+    assert client.post("/orders", json=order_payload("busy")).status_code == 200
+    assert api.admission.in_flight["orders"] == 0
+
+
+def test_backlogged_pipeline_sheds_new_orders_with_503(client):
+    client.post("/orders", json=order_payload("before-backlog"))
+    api.backlog_sampler.backlog = {"kitchen-task-queue": {"count": 3, "age": 40.0}}
+    api.backlog_sampler.sampled_at = time.monotonic()
+    resp = client.post("/orders", json=order_payload("during-backlog"))
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(api.admission.retry_after)
+    # Retries of accepted orders are still answered from the idempotency store
+    assert client.post("/orders", json=order_payload("before-backlog")).status_code == 200
+    assert client.post("/orders/batch", json={"orders": [order_payload("during-backlog")]}).status_code == 503
+    # A stale sample fails open
+    api.backlog_sampler.sampled_at -= 60
+    assert client.post("/orders", json=order_payload("during-backlog")).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_backlog_sampler_sums_enhanced_task_queue_stats():
+    from google.protobuf.duration_pb2 import Duration
+    from temporalio.api.taskqueue.v1 import TaskQueueStats, TaskQueueTypeInfo, TaskQueueVersionInfo
+    from temporalio.api.workflowservice.v1 import DescribeTaskQueueResponse
+
+    class FakeWorkflowService:
+        async def describe_task_queue(self, request):
+            assert request.report_stats
+            return DescribeTaskQueueResponse(versions_info={"": TaskQueueVersionInfo(types_info={
+                1: TaskQueueTypeInfo(stats=TaskQueueStats(approximate_backlog_count=4, approximate_backlog_age=Duration(seconds=2))),
+                2: TaskQueueTypeInfo(stats=TaskQueueStats(approximate_backlog_count=6, approximate_backlog_age=Duration(seconds=9))),
+            })})
+
+    class FakeManager:
+        async def get_client(self):
+            client = FakeTemporalClient()
+            client.namespace = "default"
+            client.workflow_service = FakeWorkflowService()
+            return client
+
+    sampler = BacklogSampler(FakeManager(), ["kitchen-task-queue"])
+    await sampler.sample()
+    assert sampler.backlog == {"kitchen-task-queue": {"count": 10, "age": 9.0}}
+    assert sampler.fresh()
+
+
+class FakeTokenBucketScript:
+    """Same contract as the Lua script, with a frozen clock."""
+    def __init__(self, capacity):
+        self.tokens = {}
+        self.calls = 0
+        self.capacity = capacity
+
+    async def __call__(self, keys, args):
+        self.calls += 1
+        capacity, rate, requested, minimum = args
+        tokens = self.tokens.get(keys[0], capacity)
+        granted = min(requested, tokens) if tokens >= minimum else 0
+        self.tokens[keys[0]] = tokens - granted
+        wait_ms = 0 if granted else int((minimum - self.tokens[keys[0]]) / rate * 1000)
+        return [granted, self.tokens[keys[0]], wait_ms]
+
+    async def refund(self, keys, args):
+        capacity, tokens = args
+        if keys[0] in self.tokens:
+            self.tokens[keys[0]] = min(capacity, self.tokens[keys[0]] + tokens)
+        return 0
+
+
+def fake_rate_limiter(capacity, lease_size=1):
+    limiter = RateLimiter("redis://unused", capacity=capacity, refill_per_second=0.5, lease_size=lease_size)
+    limiter._redis = FakeKeyValueRedis()
+    limiter._script = FakeTokenBucketScript(capacity)
+    limiter._refund_script = limiter._script.refund
+    return limiter
+
+
+def test_orders_are_rate_limited_per_api_key_or_customer(client, monkeypatch):
+    monkeypatch.setattr(api, "rate_limiter", fake_rate_limiter(capacity=2))
+    first = client.post("/orders", json=order_payload("rl-1"), headers={"X-API-Key": "kiosk"})
+    assert first.headers["X-RateLimit-Limit"] == "2"
+    assert first.headers["X-RateLimit-Remaining"] == "1"
+    client.post("/orders", json=order_payload("rl-2"), headers={"X-API-Key": "kiosk"})
+    limited = client.post("/orders", json=order_payload("rl-3"), headers={"X-API-Key": "kiosk"})
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "2"
+    assert limited.headers["X-RateLimit-Remaining"] == "0"
+    # Without an API key the caller is limited by customer name
+    assert client.post("/orders", json=order_payload("rl-3")).status_code == 200
+    batch = client.post("/orders/batch", json={"orders": [order_payload("rl-4"), order_payload("rl-5")]})
+    assert batch.status_code == 429
+
+
+def test_batches_are_charged_in_full_or_not_at_all(client, monkeypatch):
+    limiter = fake_rate_limiter(capacity=2)
+    monkeypatch.setattr(api, "rate_limiter", limiter)
+    # Larger than the bucket: refused outright rather than charged only the capacity
+    oversized = [order_payload(f"big-{i}") for i in range(3)]
+    response = client.post("/orders/batch", json={"orders": oversized}, headers={"X-API-Key": "bulk"})
+    assert response.status_code == 429
+    assert "Retry-After" not in response.headers
+    assert limiter._script.calls == 0
+    # The second customer is over its limit, so the first one's tokens are given back
+    limiter._script.tokens["ratelimit:customer:Bob"] = 0
+    mixed = [order_payload("mix-1"), dict(order_payload("mix-2"), customer_name="Bob")]
+    assert client.post("/orders/batch", json={"orders": mixed}).status_code == 429
+    assert limiter._script.tokens["ratelimit:customer:Alex"] == 2
+
+
+@pytest.mark.asyncio
+async def test_hot_keys_spend_leased_tokens_locally():
+    limiter = fake_rate_limiter(capacity=10, lease_size=4)
+    quotas = [await limiter.acquire("key:hot") for _ in range(6)]
+    # First call takes one token, the second leases four, of which three are spent locally
+    assert limiter._script.calls == 3
+    assert [q.remaining for q in quotas] == [9, 8, 7, 6, 5, 4]
+    limiter = fake_rate_limiter(capacity=1)
+    await limiter.acquire("key:flood")
+    for _ in range(3):
+        with pytest.raises(api.RateLimited):
+            await limiter.acquire("key:flood")
+    # After the first refusal the key is refused without asking Redis
+    assert limiter._script.calls == 2
+
+
+def test_health_and_metrics_report_temporal_state(client):
+    client.post("/orders", json=order_payload("order-metrics"))
+    health = client.get("/health").json()
+    assert health["status"] == "healthy"
+    assert health["temporal"]["connected"] == 2
+    latencies = client.get("/metrics").json()["latencies"]
+    assert latencies["temporal.connect"]["count"] >= 2
+    assert latencies["temporal.start_workflow"]["count"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_invalidated_client_is_reconnected(monkeypatch):
+    async def fake_connect(target_host, **kwargs):
+        return FakeTemporalClient()
+
+    monkeypatch.setattr(temporal_client.Client, "connect", fake_connect)
+    manager = temporal_client.TemporalClientManager("temporal:7233", pool_size=1, reconnect_backoff=0)
+    await manager.start()
+    first = await manager.get_client()
+    manager.invalidate(first, RuntimeError("connection reset"))
+    assert not manager.healthy
+    second = await manager.get_client()
+    assert second is not first
+    assert manager.healthy
+
+
+class FakeKeyValueRedis:
+    def __init__(self):
+        self.values = {}
+
+    def pipeline(self, transaction=True):
+        return FakeKeyValuePipeline(self)
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    async def aclose(self):
+        pass
+
+
+class FakeKeyValuePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.results = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.redis.values:
+            self.results.append(None)
+        else:
+            self.redis.values[key] = value
+            self.results.append(True)
+
+    async def execute(self):
+        return self.results
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store_is_shared_through_redis():
+    fake = FakeKeyValueRedis()
+    replica_a, replica_b = IdempotencyStore(None), IdempotencyStore(None)
+    replica_a._redis = replica_b._redis = fake
+    assert await replica_a.claim_many(["1", "2"]) == {"1": True, "2": True}
+    assert await replica_b.claim("1") is False
+    response = OrderResponse(order_id="1", workflow_id="pancake-workflow-1", status="accepted", message="ok")
+    await replica_a.complete(response)
+    await replica_a.release("2")
+    assert await replica_b.get("1") == response
+    assert await replica_b.get("2") is None
+    assert await replica_b.claim("2") is True
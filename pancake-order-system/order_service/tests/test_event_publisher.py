@@ -0,0 +1,140 @@
+# Unit tests for the batched, pipelined EventPublisher
+import asyncio
+import json
+
+import pytest
+
+from shared import event_publisher
+from shared.event_publisher import EventPublisher
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def publish(self, channel, payload):
+        self.commands.append((channel, payload))
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        self.commands.append((name, fields["data"]))
+        self.redis.xadd_maxlen = maxlen
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        self.redis.published.extend(self.commands)
+
+
+class FakeRedis:
+    instances = []
+
+    def __init__(self, connection_pool=None):
+        self.connection_pool = connection_pool
+        self.published = []
+        self.round_trips = 0
+        FakeRedis.instances.append(self)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    FakeRedis.instances = []
+    monkeypatch.setattr(event_publisher.aioredis, "Redis", FakeRedis)
+
+
+def event(i):
+    return {"status": "received", "message": f"event {i}", "order_id": f"order-{i}"}
+
+
+@pytest.mark.asyncio
+async def test_events_are_batched_into_one_pipeline():
+    publisher = EventPublisher("redis://localhost:6379", flush_interval_ms=50, batch_size=100)
+    for i in range(10):
+        await publisher.publish_event("orders", event(i))
+    await publisher.flush()
+    redis = FakeRedis.instances[0]
+    assert redis.round_trips == 1
+    assert [json.loads(p)["order_id"] for _, p in redis.published] == [f"order-{i}" for i in range(10)]
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_without_waiting_for_interval():
+    publisher = EventPublisher("redis://localhost:6379", flush_interval_ms=10_000, batch_size=5)
+    for i in range(5):
+        await publisher.publish_event("orders", event(i))
+    await asyncio.sleep(0.05)
+    assert len(FakeRedis.instances[0].published) == 5
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_pending_events():
+    publisher = EventPublisher("redis://localhost:6379", flush_interval_ms=10_000, batch_size=100)
+    for i in range(3):
+        await publisher.publish_event("orders", event(i))
+    redis = FakeRedis.instances[0]
+    await publisher.close()
+    assert len(redis.published) == 3
+
+
+@pytest.mark.asyncio
+async def test_queue_full_drops_after_timeout():
+    publisher = EventPublisher(
+        "redis://localhost:6379", flush_interval_ms=10_000, batch_size=100,
+        max_queue_size=1, enqueue_timeout=0.01
+    )
+    publisher._ensure_started()
+    publisher._flusher.cancel()
+    await publisher.publish_event("orders", event(0))
+    await publisher.publish_event("orders", event(1))
+    assert publisher._queue.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_streams_transport_appends_with_maxlen():
+    publisher = EventPublisher("redis://localhost:6379", transport="streams", stream_maxlen=500)
+    await publisher.publish_event("orders", event(1))
+    redis = FakeRedis.instances[0]
+    await publisher.close()
+    assert json.loads(redis.published[0][1])["order_id"] == "order-1"
+    assert redis.xadd_maxlen == 500
+
+
+@pytest.mark.asyncio
+async def test_events_are_sharded_by_order_id():
+    publisher = EventPublisher("redis://localhost:6379", shards=4)
+    for i in range(20):
+        await publisher.publish_event("orders", event(i))
+    redis = FakeRedis.instances[0]
+    await publisher.close()
+    for channel, payload in redis.published:
+        assert channel == event_publisher.shard_channel("orders", json.loads(payload)["order_id"], 4)
+    assert len({channel for channel, _ in redis.published}) > 1
+
+
+@pytest.mark.asyncio
+async def test_missing_fields_raise_value_error():
+    publisher = EventPublisher("redis://localhost:6379")
+    with pytest.raises(ValueError):
+        await publisher.publish_event("orders", {"status": "received"})
+
+
+@pytest.mark.asyncio
+async def test_publish_events_sends_the_group_in_one_round_trip():
+    publisher = EventPublisher("redis://localhost:6379", flush_interval_ms=10_000, batch_size=5)
+    await publisher.publish_events("orders", [event(i) for i in range(12)])
+    await asyncio.sleep(0.05)
+    redis = FakeRedis.instances[0]
+    # Sent right away and larger than batch_size, yet still one pipeline
+    assert redis.round_trips == 1
+    assert len(redis.published) == 12
+    with pytest.raises(ValueError):
+        await publisher.publish_events("orders", [event(12), {"status": "received"}])
+    await publisher.close()
+    assert len(redis.published) == 12
@@ -0,0 +1,127 @@
+# Unit tests for queue-based logging in shared/logging_config
+import logging
+import queue
+
+import orjson
+
+from shared import logging_config
+from shared.logging_config import (
+    DROP_OLDEST, DroppingQueueHandler, JsonFormatter, SamplingFilter, TemporalContextFilter,
+    bind_temporal_context, lazy_json, parse_log_rules, setup_logging
+)
+from shared.interface import OrderResponse
+
+
+def response():
+    return OrderResponse(order_id="42", workflow_id="wf-42", status="accepted", message="ok")
+
+
+def record(message, *args):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, args, None)
+
+
+def test_full_queue_drops_and_counts_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    for i in range(5):
+        handler.handle(record("event %d", i))
+    assert handler.dropped == 3
+    assert [handler.queue.get_nowait().getMessage() for _ in range(2)] == ["event 0", "event 1"]
+
+
+def test_drop_oldest_keeps_the_newest_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2), DROP_OLDEST)
+    for i in range(5):
+        handler.handle(record("event %d", i))
+    assert handler.dropped == 3
+    assert [handler.queue.get_nowait().getMessage() for _ in range(2)] == ["event 3", "event 4"]
+
+
+def test_records_are_formatted_on_the_listener_thread(capsys):
+    logger = setup_logging("queue_test", use_queue=True)
+    assert isinstance(logging.getLogger().handlers[0], DroppingQueueHandler)
+    logger.info("order %s received", "42", extra={"temporal_context": {"workflow_id": "wf-42"}})
+    # Stopping the listener writes out everything still queued
+    logging_config._stop_listener()
+    out = capsys.readouterr().out
+    assert "[queue_test] [Temporal: {\"workflow_id\": \"wf-42\"}]: order 42 received" in out
+    setup_logging("queue_test", use_queue=False)
+    assert isinstance(logging.getLogger().handlers[0], logging.StreamHandler)
+
+
+def test_mutable_arguments_are_merged_before_queueing():
+    handler = DroppingQueueHandler(queue.Queue())
+    items = ["flour"]
+    handler.handle(record("stock %s, order %s", items, "42"))
+    items.append("eggs")
+    handler.handle(record("order %s", lazy_json(response())))
+    merged, deferred = handler.queue.get_nowait(), handler.queue.get_nowait()
+    assert merged.msg == "stock ['flour'], order 42" and merged.args is None
+    # Lazy arguments are only serialized when the record is formatted
+    assert deferred.msg == "order %s" and deferred.args[0].value.order_id == "42"
+    assert deferred.getMessage() == 'order {"order_id":"42","workflow_id":"wf-42","status":"accepted","message":"ok"}'
+
+
+def test_json_formatter_writes_one_object_per_record():
+    formatter = JsonFormatter("order_service")
+    log = record("order %s received", "42")
+    log.temporal_context = {"workflow_id": "wf-42", "order": lazy_json(response())}
+    log.suppressed = 3
+    entry = orjson.loads(formatter.format(log))
+    assert entry["msg"] == "order 42 received"
+    assert entry["level"] == "INFO" and entry["service"] == "order_service"
+    assert entry["temporal"] == {"workflow_id": "wf-42", "order": response().model_dump()}
+    assert entry["suppressed"] == 3
+    assert entry["ts"].endswith("Z") and len(entry["ts"]) == 24
+
+
+def test_rate_limit_counts_suppressed_records():
+    sampler = SamplingFilter(rate_limits=parse_log_rules("test:INFO=2", int))
+    first = [record("polling %s", i) for i in range(5)]
+    for log in first:
+        log.created = 100.0
+    assert [sampler.filter(log) for log in first] == [True, True, False, False, False]
+    later = record("polling %s", 5)
+    later.created = 101.0
+    assert sampler.filter(later) and later.suppressed == 3
+    # Warnings and other loggers have no rule
+    warning = logging.LogRecord("test", logging.WARNING, __file__, 1, "polling", (), None)
+    warning.created = 100.0
+    assert sampler.filter(warning)
+
+
+def test_rate_limit_windows_of_past_seconds_are_dropped():
+    sampler = SamplingFilter(rate_limits=parse_log_rules("test:INFO=1", int))
+    for second in range(100, 103):
+        for i in range(3):
+            log = logging.LogRecord("test", logging.INFO, __file__, 1, f"order {second}-{i} done", (), None)
+            log.created = float(second)
+            sampler.filter(log)
+    assert [template for _, template in sampler._windows] == ["order 102-0 done", "order 102-1 done", "order 102-2 done"]
+
+
+def test_sampling_rules_match_child_loggers():
+    sampler = SamplingFilter(sample_rates=parse_log_rules("kitchen:DEBUG=0", float))
+    assert not sampler.filter(logging.LogRecord("kitchen.db", logging.DEBUG, __file__, 1, "query", (), None))
+    assert sampler.filter(logging.LogRecord("kitchen.db", logging.INFO, __file__, 1, "query", (), None))
+    assert sampler.filter(logging.LogRecord("kitchenette", logging.DEBUG, __file__, 1, "query", (), None))
+
+
+def test_root_rule_is_only_the_fallback_for_short_logger_names():
+    sampler = SamplingFilter(sample_rates=parse_log_rules("api:INFO=1.0,root:INFO=0.0", float))
+    assert sampler._rule("api", logging.INFO) == (1.0, None)
+    assert sampler._rule("db", logging.INFO) == (0.0, None)
+
+
+def test_context_filter_adds_bound_context_under_explicit_fields():
+    context_filter = TemporalContextFilter()
+    with bind_temporal_context(workflow_id="wf-42", attempt=2, activity_id=None):
+        bound = record("cooking")
+        context_filter.filter(bound)
+        explicit = record("retrying")
+        explicit.temporal_context = {"attempt": 3}
+        context_filter.filter(explicit)
+    outside = record("idle")
+    context_filter.filter(outside)
+    assert bound.temporal_context == {"workflow_id": "wf-42", "attempt": 2}
+    assert explicit.temporal_context == {"workflow_id": "wf-42", "attempt": 3}
+    assert outside.temporal_context == {}
@@ -0,0 +1,46 @@
+# Unit tests for the logging context interceptors in shared/temporal_context
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import asyncio
+from types import SimpleNamespace
+
+from temporalio.testing import ActivityEnvironment
+
+from shared.logging_config import temporal_context_var
+from shared.temporal_context import TemporalContextInterceptor
+
+
+class FakeOutbound:
+    async def start_workflow(self, input):
+        return SimpleNamespace(id=input.id, result_run_id="run-1")
+
+
+class FakeActivityInbound:
+    def init(self, outbound):
+        pass
+
+    async def execute_activity(self, input):
+        return dict(temporal_context_var.get())
+
+
+def test_workflow_start_binds_ids_for_the_rest_of_the_task():
+    outbound = TemporalContextInterceptor().intercept_client(FakeOutbound())
+
+    async def request():
+        await outbound.start_workflow(SimpleNamespace(id="pancake-order-42", task_queue="pancake-task-queue"))
+        return temporal_context_var.get()
+
+    context = asyncio.run(request())
+    assert context == {"workflow_id": "pancake-order-42", "run_id": "run-1", "task_queue": "pancake-task-queue"}
+    # The caller's own context is untouched
+    assert temporal_context_var.get() == {}
+
+
+def test_activity_context_is_bound_while_it_runs():
+    inbound = TemporalContextInterceptor().intercept_activity(FakeActivityInbound())
+    context = ActivityEnvironment().run(lambda: asyncio.run(inbound.execute_activity(None)))
+    assert context["workflow_id"] == "test" and context["activity_id"] == "test"
+    assert context["attempt"] == 1
+    assert temporal_context_var.get() == {}
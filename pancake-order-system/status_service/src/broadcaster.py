@@ -0,0 +1,401 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import struct
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import ormsgpack
+
+from shared.event_publisher import shard_channel, shard_channels
+from shared.metrics import metrics
+from projection import OrderProjection
+
+
+def parse_event(data: str) -> Optional[Dict[str, Any]]:
+    """Return the decoded event payload, or None if it is not a JSON object."""
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def pack_frame(message: Dict[str, Any]) -> bytes:
+    """Encode a message as a MessagePack body prefixed with its 4-byte big-endian length."""
+    body = ormsgpack.packb(message)
+    return struct.pack(">I", len(body)) + body
+
+
+def unpack_frames(data: bytes) -> List[Any]:
+    """Decode a run of length-prefixed MessagePack frames; raises ValueError if it is malformed."""
+    messages = []
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < 4:
+            raise ValueError("Truncated frame header")
+        (length,) = struct.unpack_from(">I", data, offset)
+        offset += 4
+        if len(data) - offset < length:
+            raise ValueError("Truncated frame body")
+        messages.append(ormsgpack.unpackb(data[offset:offset + length]))
+        offset += length
+    return messages
+
+
+def new_epoch() -> str:
+    """Random id of this process's sequence numbers, so ids from other processes are told apart."""
+    return os.urandom(4).hex()
+
+
+def parse_event_id(value: Optional[str], epoch: str) -> Optional[int]:
+    """
+    Sequence number of an event id ("<epoch>-<seq>") issued by this process.
+    Returns None for ids of another epoch (a restarted process or another
+    replica), which refer to an unrelated sequence, and for malformed ids.
+    """
+    if not value:
+        return None
+    prefix, _, seq = value.partition("-")
+    if prefix != epoch:
+        return None
+    try:
+        return int(seq)
+    except ValueError:
+        return None
+
+
+class Event(NamedTuple):
+    """
+    A buffered event with its SSE and WebSocket frames encoded once, up front,
+    and shared read-only by every subscriber.
+    """
+    seq: int
+    order_id: Optional[str]
+    payload: Optional[Dict[str, Any]]
+    data: str
+    frame: bytes
+    named_frame: bytes
+    packed_frame: bytes
+
+
+def encode_event(seq: int, data, epoch: str = "") -> Event:
+    """
+    Decode a raw Redis payload and pre-encode its SSE and MessagePack frames;
+    their event id is "<epoch>-<seq>".
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    payload = parse_event(data)
+    order_id = payload.get('order_id') if payload else None
+    status = payload.get('status') if payload else None
+    event_id = f"{epoch}-{seq}"
+    frame = f"id: {event_id}\ndata: {data}\n\n".encode('utf-8')
+    named_frame = frame
+    if status:
+        named_frame = f"id: {event_id}\nevent: {status}\ndata: {data}\n\n".encode('utf-8')
+    packed_frame = pack_frame({"id": event_id, **payload} if payload else {"id": event_id, "data": data})
+    return Event(
+        seq,
+        str(order_id) if order_id is not None else None,
+        payload,
+        data,
+        frame,
+        named_frame,
+        packed_frame
+    )
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent events, addressed by a monotonically
+    increasing sequence number. Sequence numbers restart with every process,
+    so the SSE event id is the sequence number prefixed with the buffer's epoch.
+    """
+    def __init__(self, capacity: int, epoch: Optional[str] = None):
+        self.capacity = capacity
+        self.epoch = epoch or new_epoch()
+        self._items: List[Optional[Event]] = [None] * capacity
+        self.next_seq = 1
+
+    @property
+    def last_seq(self) -> int:
+        return self.next_seq - 1
+
+    @property
+    def oldest_seq(self) -> int:
+        return max(1, self.next_seq - self.capacity)
+
+    def append(self, data) -> Event:
+        event = encode_event(self.next_seq, data, self.epoch)
+        self._items[event.seq % self.capacity] = event
+        self.next_seq += 1
+        return event
+
+    def get(self, seq: int) -> Optional[Event]:
+        if seq < self.oldest_seq or seq > self.last_seq:
+            return None
+        return self._items[seq % self.capacity]
+
+
+class Subscriber:
+    """
+    Per-connection read state: a cursor into the shared ring buffer plus, for
+    clients following specific orders, the sequence numbers of their events.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, order_ids: FrozenSet[str], cursor: int, named_events: bool = False):
+        self.client_id = next(self._ids)
+        self.connected_at = time.time()
+        self.order_ids = order_ids
+        # Firehose subscribers receive every event regardless of order_ids
+        self.firehose = not order_ids
+        self.named_events = named_events
+        self.cursor = cursor
+        self.pending: Deque[int] = deque()
+        # Events for followed orders not queued because the client was already too far behind
+        self.overflow = 0
+        # Coalesced events not yet delivered because they did not fit in one read
+        self.backlog: Deque[Event] = deque()
+        self.wakeup = asyncio.Event()
+        # Keepalive state managed by the HeartbeatScheduler
+        self.last_write = 0.0
+        self.ping_due = False
+        self.heartbeat_slot: Optional[int] = None
+        self.delivered = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.max_lag = 0
+
+
+class Broadcaster:
+    """
+    Fans out messages received from Redis to connected SSE clients.
+    Events are stored once in a shared ring buffer and every client reads from
+    it at its own cursor, so memory is bounded by the buffer rather than by the
+    number of clients. Clients either follow specific orders (indexed by
+    order_id) or receive the unfiltered firehose.
+    A client lagging more than `slow_client_lag` events behind is switched to
+    latest-state delivery: its backlog is collapsed to the newest event per order.
+    Every event is also folded into the order projection, when one is given.
+    """
+    def __init__(
+        self,
+        buffer_size: int = 10000,
+        slow_client_lag: int = 1000,
+        latest_size: int = 10000,
+        projection: Optional[OrderProjection] = None,
+    ):
+        self.buffer = RingBuffer(buffer_size)
+        self.projection = projection
+        self.slow_client_lag = slow_client_lag
+        self.latest_size = latest_size
+        # Newest event per order, bounded LRU used to coalesce slow clients' backlogs
+        self.latest: "OrderedDict[str, Event]" = OrderedDict()
+        self.firehose: Set[Subscriber] = set()
+        self.by_order: Dict[str, Set[Subscriber]] = {}
+        self.clients: Set[Subscriber] = set()
+        # Set whenever the set of followed orders changes, so listeners can resubscribe
+        self.subscriptions_changed = asyncio.Event()
+
+    def subscribe(
+        self,
+        order_ids: Optional[Iterable[str]] = None,
+        last_event_id: Optional[int] = None,
+        named_events: bool = False,
+    ) -> Subscriber:
+        """
+        Register a client.
+        Args:
+            order_ids: Orders to follow; None or empty subscribes to every event.
+            last_event_id: Id of the last event the client saw; newer buffered events are replayed.
+            named_events: Send frames with an `event:` field set to the event status.
+        """
+        ids = frozenset(order_ids or ())
+        cursor = self.buffer.last_seq
+        if last_event_id is not None and last_event_id <= self.buffer.last_seq:
+            cursor = max(last_event_id, 0)
+        sub = Subscriber(ids, cursor, named_events)
+        self.clients.add(sub)
+        self._index(sub)
+        if ids:
+            # Replay buffered events for the followed orders
+            for seq in range(max(cursor + 1, self.buffer.oldest_seq), self.buffer.next_seq):
+                event = self.buffer.get(seq)
+                if event.order_id in ids:
+                    sub.pending.append(seq)
+        if self.pending_count(sub):
+            sub.wakeup.set()
+        logging.info(f"Client connected ({len(ids) or 'all'} orders). Total clients: {len(self.clients)}")
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self.clients.discard(sub)
+        self._unindex(sub)
+        logging.info(f"Client removed. Total clients: {len(self.clients)}")
+
+    def update(self, sub: Subscriber, order_ids: Iterable[str], firehose: bool = False) -> None:
+        """
+        Change what a connected client follows.
+        Args:
+            sub: The connected client.
+            order_ids: Orders to follow from now on; ignored when firehose is set.
+            firehose: Receive every event instead.
+        """
+        was_firehose = sub.firehose
+        self._unindex(sub)
+        sub.order_ids = frozenset() if firehose else frozenset(order_ids)
+        sub.firehose = firehose
+        if firehose != was_firehose:
+            # Switching modes starts from the current position rather than replaying the buffer
+            sub.cursor = self.buffer.last_seq
+            sub.pending.clear()
+            sub.overflow = 0
+        elif not firehose:
+            # Keep unread events of orders that are still followed
+            sub.pending = deque(
+                seq for seq in sub.pending
+                if (event := self.buffer.get(seq)) is not None and event.order_id in sub.order_ids
+            )
+        self._index(sub)
+
+    def _index(self, sub: Subscriber) -> None:
+        if sub.firehose:
+            self.firehose.add(sub)
+        else:
+            for order_id in sub.order_ids:
+                self.by_order.setdefault(order_id, set()).add(sub)
+        self.subscriptions_changed.set()
+
+    def _unindex(self, sub: Subscriber) -> None:
+        self.firehose.discard(sub)
+        for order_id in sub.order_ids:
+            interested = self.by_order.get(order_id)
+            if interested is not None:
+                interested.discard(sub)
+                if not interested:
+                    del self.by_order[order_id]
+        self.subscriptions_changed.set()
+
+    def needed_channels(self, channel: str, shards: int, subscribe_all: bool = False) -> Set[str]:
+        """
+        Shard channels this replica has to listen to: all of them when a firehose
+        client is connected (or subscribe_all is set), otherwise only the shards
+        of the orders that connected clients follow.
+        """
+        if shards <= 1 or subscribe_all or self.firehose:
+            return set(shard_channels(channel, shards))
+        return {shard_channel(channel, order_id, shards) for order_id in self.by_order}
+
+    def publish(self, data) -> Event:
+        """Encode a message once, append it to the buffer and wake the clients interested in it."""
+        event = self.buffer.append(data)
+        if self.projection is not None:
+            self.projection.apply(event.payload)
+        if event.order_id is not None:
+            self.latest[event.order_id] = event
+            self.latest.move_to_end(event.order_id)
+            if len(self.latest) > self.latest_size:
+                self.latest.popitem(last=False)
+        for sub in self.firehose:
+            sub.wakeup.set()
+        if event.order_id is not None and event.order_id in self.by_order:
+            for sub in self.by_order[event.order_id]:
+                if len(sub.pending) >= self.slow_client_lag:
+                    # Already lagging: the latest state is picked up when the client coalesces
+                    sub.overflow += 1
+                else:
+                    sub.pending.append(event.seq)
+                sub.wakeup.set()
+        return event
+
+    def lag(self, sub: Subscriber) -> int:
+        """Number of events waiting to be delivered to the client."""
+        if not sub.firehose:
+            return len(sub.backlog) + len(sub.pending) + sub.overflow
+        return len(sub.backlog) + self.buffer.last_seq - sub.cursor
+
+    def pending_count(self, sub: Subscriber) -> int:
+        return self.lag(sub)
+
+    def read(self, sub: Subscriber, limit: int) -> List[Event]:
+        """Return up to `limit` events after the client's cursor and advance it."""
+        lag = self.lag(sub)
+        sub.max_lag = max(sub.max_lag, lag)
+        # A firehose cursor that fell out of the buffer has lost events; per-order
+        # clients only track their own seqs and skip evicted ones below
+        fell_behind = sub.firehose and sub.cursor < self.buffer.oldest_seq - 1
+        if sub.backlog:
+            # Finish delivering an earlier coalesced backlog before anything newer
+            events = [sub.backlog.popleft() for _ in range(min(limit, len(sub.backlog)))]
+        elif lag > self.slow_client_lag or fell_behind:
+            events = self._coalesce(sub, lag, limit)
+        elif not sub.firehose:
+            events = []
+            while sub.pending and len(events) < limit:
+                seq = sub.pending.popleft()
+                event = self.buffer.get(seq)
+                if event is None:
+                    self._skip(sub, 1)
+                    continue
+                events.append(event)
+                sub.cursor = seq
+        else:
+            end = min(self.buffer.last_seq, sub.cursor + limit)
+            events = [self.buffer.get(seq) for seq in range(sub.cursor + 1, end + 1)]
+            sub.cursor = end
+        sub.delivered += len(events)
+        return events
+
+    def _coalesce(self, sub: Subscriber, lag: int, limit: int) -> List[Event]:
+        """
+        Collapse a slow client's backlog to the newest event of each order it
+        follows. At most `limit` of them are returned; the rest are kept in the
+        client's backlog for its next reads.
+        """
+        if not sub.firehose:
+            candidates = (self.latest.get(order_id) for order_id in sub.order_ids)
+        else:
+            candidates = self.latest.values()
+        events = sorted(
+            (e for e in candidates if e is not None and e.seq > sub.cursor),
+            key=lambda e: e.seq
+        )
+        collapsed = max(lag - len(events), 0)
+        sub.coalesced += collapsed
+        metrics.counter("sse.coalesced").inc(collapsed)
+        sub.pending.clear()
+        sub.overflow = 0
+        sub.cursor = self.buffer.last_seq
+        sub.backlog = deque(events[limit:])
+        logging.warning(
+            f"Client {sub.client_id} lagging by {lag} event(s); "
+            f"coalesced to latest state of {len(events)} order(s)."
+        )
+        return events[:limit]
+
+    def _skip(self, sub: Subscriber, count: int) -> None:
+        sub.skipped += count
+        metrics.counter("sse.skipped").inc(count)
+        logging.warning(f"Client {sub.client_id} fell behind the event buffer. Skipped {count} message(s).")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-client delivery counters, slowest clients first."""
+        rows = [
+            {
+                "client_id": sub.client_id,
+                "connected_at": sub.connected_at,
+                "order_ids": None if sub.firehose else sorted(sub.order_ids),
+                "lag": self.lag(sub),
+                "max_lag": sub.max_lag,
+                "delivered": sub.delivered,
+                "coalesced": sub.coalesced,
+                "skipped": sub.skipped,
+            }
+            for sub in self.clients
+        ]
+        return sorted(rows, key=lambda row: row["lag"], reverse=True)
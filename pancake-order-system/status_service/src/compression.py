@@ -0,0 +1,83 @@
+import zlib
+from typing import AsyncIterator, Iterable, Optional
+
+from shared.metrics import metrics
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip and deflate are always available
+    zstandard = None
+
+
+class StreamCompressor:
+    """
+    Compression context kept for the lifetime of one connection. Every chunk is
+    flushed on its own so the client can decode it right away, while the shared
+    window lets repeated field names and phrases compress across events.
+    """
+    def __init__(self, encoding: str, level: Optional[int] = None):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._zstd = zstandard.ZstdCompressor(level=level or 3).compressobj()
+        else:
+            # gzip gets a gzip header, HTTP "deflate" is the zlib format
+            wbits = 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+            self._zlib = zlib.compressobj(level or 6, zlib.DEFLATED, wbits)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "zstd":
+            out = self._zstd.compress(data) + self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        else:
+            out = self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        metrics.counter("sse.bytes_uncompressed").inc(len(data))
+        metrics.counter("sse.bytes_compressed").inc(len(out))
+        return out
+
+
+def available_encodings(configured: Iterable[str]) -> list:
+    """Configured encodings this process can produce, in the server's order of preference."""
+    supported = {"gzip", "deflate"} | ({"zstd"} if zstandard is not None else set())
+    return [e for e in configured if e in supported]
+
+
+def negotiate_encoding(accept_encoding: Optional[str], enabled: Iterable[str]) -> Optional[str]:
+    """
+    Pick the first enabled encoding the client accepts.
+    Args:
+        accept_encoding: The request's Accept-Encoding header.
+        enabled: Encodings the server may use, most preferred first.
+    Returns:
+        The encoding to use, or None to send the stream uncompressed.
+    """
+    accepted = set()
+    # Encodings refused with q=0; a wildcard does not override them (RFC 9110, 12.5.3)
+    refused = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip()
+        q = params.strip()
+        if not name:
+            continue
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    refused.add(name)
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name)
+    for encoding in enabled:
+        if encoding in refused:
+            continue
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+async def compressed(stream: AsyncIterator[bytes], compressor: StreamCompressor) -> AsyncIterator[bytes]:
+    """Compress every chunk of a byte stream with one connection-wide context."""
+    try:
+        async for chunk in stream:
+            yield compressor.compress(chunk)
+    finally:
+        await stream.aclose()
@@ -0,0 +1,66 @@
+import asyncio
+import math
+import time
+from typing import List, Optional, Set
+
+from broadcaster import Subscriber
+from shared.metrics import metrics
+
+
+class HeartbeatScheduler:
+    """
+    One timer for every SSE connection's keepalive.
+    Connections sit in the slot of a timing wheel for the tick when they are
+    next due. Each tick only inspects the connections in its slot: those idle
+    for at least `interval` seconds get a ping flagged and are woken, the rest
+    are moved to the slot matching their last write. Writes just record a
+    timestamp, so busy connections cost nothing per tick.
+    """
+    def __init__(self, interval: float = 15.0, tick: float = 1.0):
+        self.interval = interval
+        self.tick = min(tick, interval)
+        self.slots: List[Set[Subscriber]] = [set() for _ in range(math.ceil(self.interval / self.tick) + 1)]
+        self.position = 0
+
+    def add(self, sub: Subscriber, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        sub.last_write = now
+        self._schedule(sub, now + self.interval, now)
+
+    def remove(self, sub: Subscriber) -> None:
+        if sub.heartbeat_slot is not None:
+            self.slots[sub.heartbeat_slot].discard(sub)
+            sub.heartbeat_slot = None
+
+    def touch(self, sub: Subscriber) -> None:
+        """Record a write; the connection is rescheduled lazily when its slot comes up."""
+        sub.last_write = time.monotonic()
+
+    def _schedule(self, sub: Subscriber, due: float, now: float) -> None:
+        ticks_ahead = min(max(1, math.ceil((due - now) / self.tick)), len(self.slots) - 1)
+        slot = (self.position + ticks_ahead) % len(self.slots)
+        self.slots[slot].add(sub)
+        sub.heartbeat_slot = slot
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """Process the next tick's slot and return the number of pings flagged."""
+        now = time.monotonic() if now is None else now
+        self.position = (self.position + 1) % len(self.slots)
+        due, self.slots[self.position] = self.slots[self.position], set()
+        pings = 0
+        for sub in due:
+            # Half a tick of slack so slot rounding never postpones a ping by a whole tick
+            if now - sub.last_write >= self.interval - self.tick / 2:
+                sub.ping_due = True
+                sub.wakeup.set()
+                pings += 1
+                self._schedule(sub, now + self.interval, now)
+            else:
+                self._schedule(sub, sub.last_write + self.interval, now)
+        return pings
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+            metrics.counter("sse.heartbeat_ticks").inc()
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Set
+
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+
+from broadcaster import Broadcaster
+
+
+async def wait_for_subscription_change(broadcaster: Broadcaster, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(broadcaster.subscriptions_changed.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def redis_listener(
+    broadcaster: Broadcaster,
+    redis_url: str,
+    channel: str,
+    shards: int = 1,
+    subscribe_all: bool = False,
+) -> None:
+    """
+    Subscribe to the Redis channel (or the shards of it that connected clients
+    need) and feed every message to the broadcaster, reconnecting on error.
+    """
+    while True:
+        r = aioredis.from_url(redis_url)
+        try:
+            pubsub = r.pubsub()
+            subscribed: Set[str] = set()
+            while True:
+                if broadcaster.subscriptions_changed.is_set() or not subscribed:
+                    broadcaster.subscriptions_changed.clear()
+                    needed = broadcaster.needed_channels(channel, shards, subscribe_all)
+                    if needed - subscribed:
+                        await pubsub.subscribe(*(needed - subscribed))
+                        logging.info(f"Subscribed to Redis channel(s): {sorted(needed - subscribed)}")
+                    if subscribed - needed:
+                        await pubsub.unsubscribe(*(subscribed - needed))
+                        logging.info(f"Unsubscribed from Redis channel(s): {sorted(subscribed - needed)}")
+                    subscribed = needed
+                if not subscribed:
+                    # No client needs any shard yet
+                    await wait_for_subscription_change(broadcaster, timeout=1)
+                    continue
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.25)
+                if message and message.get('type') == 'message':
+                    broadcaster.publish(message['data'])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Redis listener error: {e}. Retrying in 5s...")
+            await asyncio.sleep(5)
+        finally:
+            await r.aclose()
+
+
+def group_start_id(lookback_seconds: float) -> str:
+    """
+    Stream ID a new consumer group starts reading at: entries added in the
+    last `lookback_seconds` (stream IDs start with their millisecond
+    timestamp), or only new entries ("$") when it is 0.
+    """
+    if lookback_seconds <= 0:
+        return "$"
+    return f"{int((time.time() - lookback_seconds) * 1000)}-0"
+
+
+async def ensure_consumer_group(r: aioredis.Redis, stream: str, group: str, start_id: str = "$") -> None:
+    """Create the consumer group (and the stream) at `start_id` unless it already exists."""
+    try:
+        await r.xgroup_create(stream, group, id=start_id, mkstream=True)
+        logging.info(f"Created consumer group '{group}' on stream '{stream}' at {start_id}")
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def redis_stream_listener(
+    broadcaster: Broadcaster,
+    redis_url: str,
+    stream: str,
+    group: str,
+    consumer: str,
+    shards: int = 1,
+    subscribe_all: bool = False,
+    count: int = 100,
+    block_ms: int = 1000,
+    group_lookback_seconds: float = 0,
+) -> None:
+    """
+    Read order events from a Redis Stream (or the shard streams connected
+    clients need) through a consumer group and feed them to the broadcaster.
+    The group's offset lives in Redis, so after a reconnect or restart reading
+    resumes right after the last acknowledged entry and nothing published in
+    between is lost. Each status_service replica uses its own group so every
+    replica sees every event. A group that does not exist yet is created
+    `group_lookback_seconds` back, so events published just before it was
+    created are read as well.
+    """
+    retry_delay = 0.5
+    while True:
+        r = aioredis.from_url(redis_url)
+        try:
+            # Per stream: "0" while re-reading entries delivered to us but never
+            # acknowledged (e.g. crash mid-batch), then ">" for new entries
+            offsets: Dict[str, str] = {}
+            first_pass = True
+            while True:
+                if broadcaster.subscriptions_changed.is_set() or first_pass:
+                    broadcaster.subscriptions_changed.clear()
+                    first_pass = False
+                    needed = broadcaster.needed_channels(stream, shards, subscribe_all)
+                    for key in needed - offsets.keys():
+                        await ensure_consumer_group(r, key, group, group_start_id(group_lookback_seconds))
+                        offsets[key] = "0"
+                    offsets = {key: offsets[key] for key in needed}
+                    logging.info(f"Reading Redis stream(s) {sorted(offsets)} as {group}/{consumer}")
+                if not offsets:
+                    await wait_for_subscription_change(broadcaster, timeout=1)
+                    continue
+                response = await r.xreadgroup(group, consumer, offsets, count=count, block=block_ms)
+                returned = {}
+                for key, entries in response or []:
+                    key = key.decode('utf-8') if isinstance(key, bytes) else key
+                    returned[key] = entries
+                    for _, fields in entries:
+                        # Entries trimmed away while pending come back with no fields
+                        fields = fields or {}
+                        data = fields.get(b'data', fields.get('data'))
+                        if data is not None:
+                            broadcaster.publish(data)
+                    if entries:
+                        await r.xack(key, group, *(entry_id for entry_id, _ in entries))
+                for key, offset in offsets.items():
+                    if offset == "0" and not returned.get(key):
+                        offsets[key] = ">"
+                retry_delay = 0.5
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Redis stream listener error: {e}. Retrying in {retry_delay:.1f}s...")
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 5)
+        finally:
+            await r.aclose()
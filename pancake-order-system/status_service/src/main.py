@@ -1,13 +1,21 @@
 import os
+import json
 import logging
-import redis
-import threading
-import queue
-import time
+import asyncio
 import random
-from flask import Flask, Response, stream_with_context
-from flask_cors import CORS
+import socket
+from contextlib import asynccontextmanager
+from typing import Any, List, Optional
+from fastapi import FastAPI, HTTPException, Query, Header, WebSocket
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
+from shared.metrics import metrics
+from broadcaster import Broadcaster, Subscriber, Event, pack_frame, parse_event_id, unpack_frames
+from listeners import redis_listener, redis_stream_listener
+from heartbeat import HeartbeatScheduler
+from projection import OrderProjection
+from compression import StreamCompressor, available_encodings, compressed, negotiate_encoding
 
 load_dotenv()
 
@@ -18,75 +26,313 @@ REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_DB = int(os.getenv('REDIS_DB', 0))
 REDIS_CHANNEL = os.getenv('REDIS_CHANNEL', 'orders')
+REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
+# Number of shard channels events are spread over by order_id; must match the publishers
+REDIS_CHANNEL_SHARDS = int(os.getenv('REDIS_CHANNEL_SHARDS', 1))
+# Listen to every shard even when no firehose client is connected
+STATUS_SERVICE_SUBSCRIBE_ALL = os.getenv('STATUS_SERVICE_SUBSCRIBE_ALL', 'false').lower() == 'true'
+# 'pubsub' (default) or 'streams'; must match the publishers' EVENT_TRANSPORT
+EVENT_TRANSPORT = os.getenv('EVENT_TRANSPORT', 'pubsub')
+# Consumer group per replica, so every replica receives every event and resumes from its own offset.
+# Required with the streams transport and must survive restarts (e.g. a StatefulSet pod name):
+# a new name starts a new group, which skips whatever the old one had not read yet
+STATUS_SERVICE_CONSUMER_GROUP = os.getenv('STATUS_SERVICE_CONSUMER_GROUP')
+# A new consumer group starts this many seconds back in the stream; 0 reads only new entries
+STATUS_SERVICE_GROUP_LOOKBACK_SECONDS = float(os.getenv('STATUS_SERVICE_GROUP_LOOKBACK_SECONDS', 60))
+# One consumer per group; a stable name lets a restarted replica re-read its own unacknowledged entries
+STATUS_SERVICE_CONSUMER = os.getenv('STATUS_SERVICE_CONSUMER', STATUS_SERVICE_CONSUMER_GROUP or socket.gethostname())
+# Number of recent events kept for all clients and for Last-Event-ID replay
+STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', 10000))
+# Clients further behind than this only receive the latest state of each order
+STREAM_SLOW_CLIENT_LAG = int(os.getenv('STREAM_SLOW_CLIENT_LAG', 1000))
+# Upper bound on messages written to a client in one chunk
+STREAM_MAX_BATCH = int(os.getenv('STREAM_MAX_BATCH', 100))
+# How long to keep collecting messages after the first one before writing the chunk
+STREAM_BATCH_LATENCY_MS = float(os.getenv('STREAM_BATCH_LATENCY_MS', 5))
 
-app = Flask(__name__)
-CORS(app)
+# Seconds a connection may stay silent before it is sent a keepalive
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', 15))
+# Encodings /stream may use, most preferred first (e.g. "zstd,gzip,deflate"); empty disables compression
+SSE_COMPRESSION = available_encodings(e.strip().lower() for e in os.getenv('SSE_COMPRESSION', '').split(',') if e.strip())
+# Compression level; 0 uses the encoding's default
+SSE_COMPRESSION_LEVEL = int(os.getenv('SSE_COMPRESSION_LEVEL', 0)) or None
 
-# Global client list with thread lock
-clients = []
-clients_lock = threading.Lock()
+# Order status read model: seconds an order is kept after its last event, and in-memory bounds
+ORDER_PROJECTION_TTL = int(os.getenv('ORDER_PROJECTION_TTL', 86400))
+ORDER_PROJECTION_MAX_ORDERS = int(os.getenv('ORDER_PROJECTION_MAX_ORDERS', 100000))
+ORDER_PROJECTION_HISTORY = int(os.getenv('ORDER_PROJECTION_HISTORY', 50))
+ORDER_PROJECTION_KEY_PREFIX = os.getenv('ORDER_PROJECTION_KEY_PREFIX', 'order_status:')
+ORDER_PROJECTION_FLUSH_MS = float(os.getenv('ORDER_PROJECTION_FLUSH_MS', 100))
+# Upper bound on ids per bulk lookup
+ORDER_LOOKUP_MAX_IDS = int(os.getenv('ORDER_LOOKUP_MAX_IDS', 1000))
 
-def redis_listener():
-    while True:
+# All SSE clients are served from one event loop
+projection = OrderProjection(
+    REDIS_URL, ORDER_PROJECTION_TTL, ORDER_PROJECTION_MAX_ORDERS, ORDER_PROJECTION_HISTORY,
+    ORDER_PROJECTION_KEY_PREFIX, ORDER_PROJECTION_FLUSH_MS
+)
+broadcaster = Broadcaster(STREAM_BUFFER_SIZE, STREAM_SLOW_CLIENT_LAG, projection=projection)
+heartbeats = HeartbeatScheduler(SSE_HEARTBEAT_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if EVENT_TRANSPORT == 'streams':
+        if not STATUS_SERVICE_CONSUMER_GROUP:
+            raise RuntimeError(
+                "STATUS_SERVICE_CONSUMER_GROUP must be set to a name that is stable across restarts "
+                "when EVENT_TRANSPORT=streams"
+            )
+        listener = asyncio.create_task(redis_stream_listener(
+            broadcaster, REDIS_URL, REDIS_CHANNEL, STATUS_SERVICE_CONSUMER_GROUP, STATUS_SERVICE_CONSUMER,
+            REDIS_CHANNEL_SHARDS, STATUS_SERVICE_SUBSCRIBE_ALL,
+            group_lookback_seconds=STATUS_SERVICE_GROUP_LOOKBACK_SECONDS
+        ))
+    else:
+        listener = asyncio.create_task(redis_listener(
+            broadcaster, REDIS_URL, REDIS_CHANNEL, REDIS_CHANNEL_SHARDS, STATUS_SERVICE_SUBSCRIBE_ALL
+        ))
+    heartbeat_timer = asyncio.create_task(heartbeats.run())
+    projection_writer = asyncio.create_task(projection.run())
+    yield
+    logging.info("Shutting down server...")
+    for task in (listener, heartbeat_timer, projection_writer):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+app = FastAPI(title="Pancake Status Service", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+def frames(sub: Subscriber, events: List[Event]) -> bytes:
+    """Join the subscriber's pre-encoded frames; a single frame is passed through without copying."""
+    if sub.named_events:
+        encoded = [event.named_frame for event in events]
+    else:
+        encoded = [event.frame for event in events]
+    return encoded[0] if len(encoded) == 1 else b"".join(encoded)
+
+async def wait_for_batch(sub: Subscriber) -> None:
+    """Give more events up to the latency budget to arrive so they share one chunk."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_BATCH_LATENCY_MS / 1000
+    while broadcaster.pending_count(sub) < STREAM_MAX_BATCH:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        sub.wakeup.clear()
         try:
-            r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
-            pubsub = r.pubsub()
-            pubsub.subscribe(REDIS_CHANNEL)
-            logging.info(f"Subscribed to Redis channel: {REDIS_CHANNEL}")
-            for message in pubsub.listen():
-                if message.get('type') == 'message':
-                    data = message['data']
-                    with clients_lock:
-                        for q in clients:
-                            try:
-                                q.put_nowait(data)
-                            except queue.Full:
-                                logging.warning("Client queue full. Dropping message.")
-        except Exception as e:
-            logging.error(f"Redis listener error: {e}. Retrying in 5s...")
-            time.sleep(5)
-
-def event_stream(q):
-    heartbeat_counter = 0
+            await asyncio.wait_for(sub.wakeup.wait(), timeout=remaining)
+        except asyncio.TimeoutError:
+            break
+
+def snapshot_frame(orders: dict) -> bytes:
+    """SSE frame with the current state of the client's orders; it has no id so Last-Event-ID is unaffected."""
+    return f"event: snapshot\ndata: {json.dumps({'orders': orders})}\n\n".encode('utf-8')
+
+async def event_stream(sub: Subscriber, initial: bytes = b""):
     try:
+        if initial:
+            heartbeats.touch(sub)
+            yield initial
         while True:
-            try:
-                data = q.get(timeout=1)
-                yield f"data: {data.decode('utf-8') if isinstance(data, bytes) else data}\n\n"
-            except queue.Empty:
-                if heartbeat_counter % 5 == 0:  # Reduce heartbeat log noise
-                    logging.info("Heartbeat sent to SSE client")
-                yield ":ping\n\n"
-                heartbeat_counter += 1
-            time.sleep(0.1)
-    except GeneratorExit:
-        logging.info("Client disconnected (GeneratorExit)")
-        with clients_lock:
-            if q in clients:
-                clients.remove(q)
-        logging.info("Client removed from list")
-
-@app.route('/stream')
-def stream():
-    q = queue.Queue(maxsize=1000)
-    with clients_lock:
-        clients.append(q)
-    logging.info(f"Client connected. Total clients: {len(clients)}")
-    return Response(stream_with_context(event_stream(q)), mimetype="text/event-stream")
-
-@app.route('/test_stream')
-def test_stream():
-    def generate_random_numbers():
+            if not broadcaster.pending_count(sub):
+                # Woken by new events or by the heartbeat scheduler
+                sub.wakeup.clear()
+                await sub.wakeup.wait()
+                if sub.ping_due and not broadcaster.pending_count(sub):
+                    sub.ping_due = False
+                    heartbeats.touch(sub)
+                    metrics.counter("sse.heartbeats").inc()
+                    yield b":ping\n\n"
+                    continue
+            # Write every pending message as one chunk instead of one write per message
+            await wait_for_batch(sub)
+            events = broadcaster.read(sub, STREAM_MAX_BATCH)
+            if events:
+                sub.ping_due = False
+                heartbeats.touch(sub)
+                yield frames(sub, events)
+    finally:
+        release(sub)
+
+def release(sub: Subscriber) -> None:
+    """Drop an SSE client's subscription and heartbeat entry; safe to call more than once."""
+    heartbeats.remove(sub)
+    if sub in broadcaster.clients:
+        logging.info("Client disconnected")
+        broadcaster.unsubscribe(sub)
+
+class SubscriberStreamingResponse(StreamingResponse):
+    """
+    Streaming response that releases its subscriber when the response ends,
+    including when the client disconnects before the body is ever iterated
+    (in which case the stream generator's own cleanup never runs).
+    """
+    def __init__(self, content, sub: Subscriber, **kwargs):
+        super().__init__(content, **kwargs)
+        self.sub = sub
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            release(self.sub)
+
+def parse_order_ids(order_id: Optional[List[str]]) -> List[str]:
+    """Accept both repeated (?order_id=a&order_id=b) and comma-separated (?order_id=a,b) ids."""
+    return [i.strip() for value in order_id or [] for i in value.split(',') if i.strip()]
+
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    """Buffer sequence number of a Last-Event-ID; ids issued by another process or replica are ignored."""
+    return parse_event_id(value, broadcaster.buffer.epoch)
+
+@app.get('/stream')
+async def stream(
+    order_id: Optional[List[str]] = Query(None),
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    named_events: bool = False,
+    compress: bool = True,
+    snapshot: bool = True,
+    accept_encoding: Optional[str] = Header(None),
+):
+    # Without order_id the client gets every event (kitchen dashboards).
+    # Browsers send Last-Event-ID on reconnect; missed events are replayed from the buffer.
+    order_ids = parse_order_ids(order_id)
+    sub = broadcaster.subscribe(
+        order_ids,
+        parse_last_event_id(last_event_id_header or last_event_id),
+        named_events
+    )
+    heartbeats.add(sub)
+    try:
+        # Clients following specific orders first get their current state. Subscribing
+        # first means events published during the lookup are not missed.
+        initial = snapshot_frame(await projection.fetch(order_ids)) if snapshot and order_ids else b""
+    except BaseException:
+        release(sub)
+        raise
+    encoding = negotiate_encoding(accept_encoding, SSE_COMPRESSION) if compress else None
+    if encoding is None:
+        return SubscriberStreamingResponse(event_stream(sub, initial), sub, media_type="text/event-stream")
+    return SubscriberStreamingResponse(
+        compressed(event_stream(sub, initial), StreamCompressor(encoding, SSE_COMPRESSION_LEVEL)),
+        sub,
+        media_type="text/event-stream",
+        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+    )
+
+def apply_control(sub: Subscriber, request: Any) -> dict:
+    """
+    Apply a client's control message to its subscription and return the reply.
+    Supported messages:
+        {"action": "subscribe", "order_ids": [...]}   follow more orders
+        {"action": "subscribe", "all": true}           follow every order
+        {"action": "unsubscribe", "order_ids": [...]} stop following orders (all of them if omitted)
+    """
+    if not isinstance(request, dict):
+        return {"error": "Control messages must be maps"}
+    action = request.get("action")
+    raw_ids = request.get("order_ids") or []
+    if not isinstance(raw_ids, list) or not all(isinstance(i, (str, int)) and not isinstance(i, bool) for i in raw_ids):
+        return {"error": "order_ids must be a list of strings or integers"}
+    order_ids = {str(i) for i in raw_ids}
+    if action == "subscribe":
+        if request.get("all"):
+            broadcaster.update(sub, (), firehose=True)
+        else:
+            broadcaster.update(sub, order_ids | (set() if sub.firehose else sub.order_ids))
+    elif action == "unsubscribe":
+        broadcaster.update(sub, sub.order_ids - order_ids if order_ids else ())
+    else:
+        return {"error": f"Unknown action: {action}"}
+    return {"ack": action, "order_ids": None if sub.firehose else sorted(sub.order_ids)}
+
+async def websocket_reader(websocket: WebSocket, sub: Subscriber, replies: List[bytes]) -> None:
+    """Handle control messages until the client disconnects; replies are queued for the writer."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        try:
+            if message.get("bytes") is not None:
+                requests = unpack_frames(message["bytes"])
+            else:
+                requests = [json.loads(message.get("text") or "")]
+        except ValueError as e:
+            requests = []
+            replies.append(pack_frame({"error": f"Malformed control message: {e}"}))
+        for request in requests:
+            replies.append(pack_frame(apply_control(sub, request)))
+        sub.wakeup.set()
+
+async def websocket_writer(websocket: WebSocket, sub: Subscriber, replies: List[bytes]) -> None:
+    """Send pending replies and events, batched into one binary message of concatenated frames."""
+    while True:
+        if not replies and not broadcaster.pending_count(sub):
+            sub.wakeup.clear()
+            await sub.wakeup.wait()
+        if broadcaster.pending_count(sub):
+            await wait_for_batch(sub)
+        chunk = replies[:] + [event.packed_frame for event in broadcaster.read(sub, STREAM_MAX_BATCH)]
+        replies.clear()
+        if chunk:
+            await websocket.send_bytes(b"".join(chunk))
+
+@app.websocket('/ws')
+async def websocket_stream(
+    websocket: WebSocket,
+    order_id: Optional[List[str]] = Query(None),
+    last_event_id: Optional[str] = Query(None),
+):
+    # Same events as /stream, as length-prefixed MessagePack frames; the client
+    # changes its subscriptions by sending control messages on the same socket
+    await websocket.accept()
+    sub = broadcaster.subscribe(parse_order_ids(order_id), parse_last_event_id(last_event_id))
+    replies: List[bytes] = []
+    tasks = [
+        asyncio.create_task(websocket_reader(websocket, sub, replies)),
+        asyncio.create_task(websocket_writer(websocket, sub, replies)),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        logging.info("WebSocket client disconnected")
+        broadcaster.unsubscribe(sub)
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+
+@app.get('/orders/{order_id}')
+async def get_order(order_id: str):
+    state = (await projection.fetch([order_id]))[order_id]
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Unknown order: {order_id}")
+    return state
+
+@app.get('/orders')
+async def get_orders(ids: Optional[List[str]] = Query(None)):
+    # Same id syntax as /stream: ?ids=a&ids=b or ?ids=a,b; unknown orders map to null
+    order_ids = parse_order_ids(ids)
+    if len(order_ids) > ORDER_LOOKUP_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {ORDER_LOOKUP_MAX_IDS} ids per request")
+    return {"orders": await projection.fetch(order_ids)}
+
+@app.get('/metrics')
+async def get_metrics():
+    return {**metrics.snapshot(), "clients": broadcaster.stats()}
+
+@app.get('/test_stream')
+async def test_stream():
+    async def generate_random_numbers():
         while True:
             random_number = random.randint(1, 100)
             yield f"data: {random_number}\n\n"
-            time.sleep(1)
-    return Response(stream_with_context(generate_random_numbers()), mimetype="text/event-stream")
+            await asyncio.sleep(1)
+    return StreamingResponse(generate_random_numbers(), media_type="text/event-stream")
 
 if __name__ == "__main__":
-    try:
-        t = threading.Thread(target=redis_listener, daemon=True)
-        t.start()
-        app.run(host="0.0.0.0", port=5001, threaded=True)
-    except KeyboardInterrupt:
-        logging.info("Shutting down server...")
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv('STATUS_SERVICE_PORT', 5001)))
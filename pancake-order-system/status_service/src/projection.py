@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import redis.asyncio as aioredis
+
+from shared.metrics import metrics
+
+
+class OrderProjection:
+    """
+    Read model of every order's latest status, status history and the time each
+    stage was first reached, built incrementally from the order events.
+    Orders are kept in an in-memory LRU and written behind to Redis, so state
+    survives restarts and is shared with other replicas. Writes only ever add
+    to what Redis holds: the latest status goes to a hash, the first time of
+    each stage is set with HSETNX and history entries are appended to a list.
+    A replica that never saw an order's earlier events therefore cannot erase
+    them. Orders not updated for `ttl` seconds are evicted from memory and
+    expire in Redis.
+    """
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        ttl: int = 86400,
+        max_orders: int = 100000,
+        history_limit: int = 50,
+        key_prefix: str = "order_status:",
+        flush_interval_ms: float = 100,
+    ):
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.max_orders = max_orders
+        self.history_limit = history_limit
+        self.key_prefix = key_prefix
+        self.flush_interval = flush_interval_ms / 1000
+        self.orders: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        # Changes not yet written to Redis, per order
+        self._new_history: Dict[str, List[Dict[str, Any]]] = {}
+        self._new_stages: Dict[str, Dict[str, float]] = {}
+        # Orders first seen in an event rather than loaded; Redis may know more about them
+        self._unverified: Set[str] = set()
+        self._redis: Optional[aioredis.Redis] = None
+
+    def _client(self) -> Optional[aioredis.Redis]:
+        if self._redis is None and self.redis_url:
+            self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+        return self._redis
+
+    def apply(self, payload: Optional[Dict[str, Any]], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Fold one event into its order's state and return the new state."""
+        if not payload or payload.get('order_id') is None or not payload.get('status'):
+            return None
+        now = time.time() if now is None else now
+        order_id = str(payload['order_id'])
+        status = str(payload['status'])
+        message = payload.get('message')
+        state = self.orders.get(order_id)
+        if state is None:
+            state = {"order_id": order_id, "status": None, "message": None, "updated_at": None, "stages": {}, "history": []}
+            self.orders[order_id] = state
+            self._unverified.add(order_id)
+        history = state["history"]
+        if history and history[-1]["status"] == status and history[-1]["message"] == message:
+            # Redelivered event (e.g. a stream entry read again after a reconnect)
+            return state
+        entry = {"status": status, "message": message, "at": now}
+        history.append(entry)
+        del history[:-self.history_limit]
+        self._new_history.setdefault(order_id, []).append(entry)
+        if status not in state["stages"]:
+            state["stages"][status] = now
+            self._new_stages.setdefault(order_id, {})[status] = now
+        state.update(status=status, message=message, updated_at=now)
+        self.orders.move_to_end(order_id)
+        self._dirty.add(order_id)
+        if len(self.orders) > self.max_orders:
+            self._forget(self.orders.popitem(last=False)[0])
+        metrics.counter("projection.applied").inc()
+        return state
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """In-memory state of an order, or None if it is not cached."""
+        return self.orders.get(order_id)
+
+    async def fetch(self, order_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Look up several orders, reading the ones missing from memory from Redis.
+        Orders this replica only knows from events it saw itself are read once
+        as well, since Redis may hold their earlier history.
+        Args:
+            order_ids: Orders to look up.
+        Returns:
+            A dict from order_id to its state, or None for unknown orders.
+        """
+        result = {order_id: self.orders.get(order_id) for order_id in order_ids}
+        to_read = [order_id for order_id, state in result.items() if state is None or order_id in self._unverified]
+        r = self._client()
+        if to_read and r is not None:
+            if any(order_id in self._dirty for order_id in to_read):
+                # Write our own changes first so the read returns the merged state
+                await self.flush()
+            try:
+                async with r.pipeline(transaction=False) as pipe:
+                    for order_id in to_read:
+                        pipe.hgetall(self.key_prefix + order_id)
+                        pipe.lrange(self._history_key(order_id), -self.history_limit, -1)
+                    rows = await pipe.execute()
+            except Exception as e:
+                logging.error(f"Failed to read order projection from Redis: {e}")
+                rows = [None, None] * len(to_read)
+            for i, order_id in enumerate(to_read):
+                row, history = rows[2 * i], rows[2 * i + 1]
+                if row and order_id not in self._dirty:
+                    result[order_id] = self._cache(self._decode(order_id, row, history))
+                    self._unverified.discard(order_id)
+        metrics.counter("projection.lookups").inc(len(result))
+        return result
+
+    def _cache(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # Loaded state is already in Redis, so it is cached without being marked dirty
+        self.orders[state["order_id"]] = state
+        if len(self.orders) > self.max_orders:
+            self._forget(self.orders.popitem(last=False)[0])
+        return self.orders[state["order_id"]]
+
+    def _forget(self, order_id: str) -> None:
+        self._dirty.discard(order_id)
+        self._unverified.discard(order_id)
+        self._new_history.pop(order_id, None)
+        self._new_stages.pop(order_id, None)
+
+    def _history_key(self, order_id: str) -> str:
+        return f"{self.key_prefix}{order_id}:history"
+
+    @staticmethod
+    def _decode(order_id: str, row: Dict[str, str], history: Optional[List[str]]) -> Dict[str, Any]:
+        return {
+            "order_id": order_id,
+            "status": row.get("status"),
+            "message": json.loads(row.get("message", "null")),
+            "updated_at": float(row["updated_at"]) if row.get("updated_at") else None,
+            "stages": {k[len("stage:"):]: float(v) for k, v in row.items() if k.startswith("stage:")},
+            "history": [json.loads(entry) for entry in history or []],
+        }
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Drop orders not updated for `ttl` seconds from memory; returns how many were dropped."""
+        now = time.time() if now is None else now
+        expired = 0
+        # Entries are kept in update order, so the stale ones are at the front
+        while self.orders:
+            order_id, state = next(iter(self.orders.items()))
+            if state["updated_at"] is not None and now - state["updated_at"] < self.ttl:
+                break
+            self.orders.popitem(last=False)
+            self._forget(order_id)
+            expired += 1
+        return expired
+
+    async def flush(self) -> None:
+        """Write the changes made since the last flush to Redis in one round-trip."""
+        r = self._client()
+        if r is None or not self._dirty:
+            self._dirty.clear()
+            self._new_history.clear()
+            self._new_stages.clear()
+            return
+        dirty, self._dirty = self._dirty, set()
+        new_history, self._new_history = self._new_history, {}
+        new_stages, self._new_stages = self._new_stages, {}
+        try:
+            async with r.pipeline(transaction=False) as pipe:
+                for order_id in dirty:
+                    state = self.orders.get(order_id)
+                    if state is None:
+                        continue
+                    key, history_key = self.key_prefix + order_id, self._history_key(order_id)
+                    pipe.hset(key, mapping={
+                        "status": state["status"],
+                        "message": json.dumps(state["message"]),
+                        "updated_at": repr(state["updated_at"]),
+                    })
+                    for stage, at in new_stages.get(order_id, {}).items():
+                        pipe.hsetnx(key, f"stage:{stage}", repr(at))
+                    entries = new_history.get(order_id)
+                    if entries:
+                        pipe.rpush(history_key, *(json.dumps(entry) for entry in entries))
+                        pipe.ltrim(history_key, -self.history_limit, -1)
+                    pipe.expire(key, self.ttl)
+                    pipe.expire(history_key, self.ttl)
+                await pipe.execute()
+            metrics.counter("projection.flushed").inc(len(dirty))
+        except Exception as e:
+            # Keep the changes pending so the next flush retries them
+            self._dirty |= dirty
+            for order_id, entries in new_history.items():
+                self._new_history[order_id] = entries + self._new_history.get(order_id, [])
+            for order_id, stages in new_stages.items():
+                self._new_stages[order_id] = {**stages, **self._new_stages.get(order_id, {})}
+            metrics.counter("projection.flush_errors").inc()
+            logging.error(f"Failed to write order projection to Redis: {e}")
+
+    async def run(self) -> None:
+        """Background task: write changes behind to Redis and evict stale orders."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+                self.expire()
+        finally:
+            await self.flush()
+            if self._redis is not None:
+                await self._redis.aclose()
+                self._redis = None
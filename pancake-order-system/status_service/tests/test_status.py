@@ -0,0 +1,508 @@
+# Unit tests for the status_service SSE fan-out
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import asyncio
+import time
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import main
+import listeners
+from broadcaster import Broadcaster, pack_frame, unpack_frames
+from heartbeat import HeartbeatScheduler
+from projection import OrderProjection
+from compression import StreamCompressor, compressed, negotiate_encoding
+from shared.event_publisher import shard_channel
+
+
+def event(order_id, status="received"):
+    return f'{{"order_id": "{order_id}", "status": "{status}"}}'.encode()
+
+
+def test_broadcaster_fans_out_to_every_client():
+    broadcaster = Broadcaster()
+    subs = [broadcaster.subscribe() for _ in range(3)]
+    broadcaster.publish(event("1"))
+    reads = [broadcaster.read(sub, 10) for sub in subs]
+    assert all([e.data for e in events] == [event("1").decode()] for events in reads)
+    # Every subscriber gets the very same pre-encoded frame
+    assert reads[0][0].frame is reads[1][0].frame is reads[2][0].frame
+    broadcaster.unsubscribe(subs[0])
+    assert len(broadcaster.clients) == 2
+
+
+def test_client_behind_the_buffer_gets_latest_state_per_order():
+    broadcaster = Broadcaster(buffer_size=2)
+    sub = broadcaster.subscribe()
+    for status in ("received", "analysis", "making"):
+        broadcaster.publish(event("1", status))
+    # Older events were overwritten before the client read them
+    events = broadcaster.read(sub, 10)
+    assert [e.seq for e in events] == [3]
+    assert '"making"' in events[0].data
+    assert sub.coalesced == 2
+
+
+def test_order_client_is_not_coalesced_by_unrelated_buffer_churn(caplog):
+    broadcaster = Broadcaster(buffer_size=100)
+    follower = broadcaster.subscribe(["42"])
+    for i in range(150):
+        broadcaster.publish(event(f"other-{i}"))
+    for status in ("received", "analysis", "making"):
+        broadcaster.publish(event("42", status))
+    # Its cursor is older than the buffer, but none of its own events were evicted
+    events = broadcaster.read(follower, 10)
+    assert [e.seq for e in events] == [151, 152, 153]
+    assert follower.coalesced == 0 and follower.skipped == 0
+    assert "lagging" not in caplog.text
+
+
+def test_slow_consumer_backlog_is_coalesced_by_order():
+    broadcaster = Broadcaster(slow_client_lag=3)
+    firehose = broadcaster.subscribe()
+    follower = broadcaster.subscribe(["1"])
+    for status in ("received", "analysis", "inventory_check", "making"):
+        broadcaster.publish(event("1", status))
+        broadcaster.publish(event("2", status))
+    assert broadcaster.lag(follower) == 4
+    assert [e.order_id for e in broadcaster.read(firehose, 100)] == ["1", "2"]
+    assert firehose.coalesced == 6
+    follower_events = broadcaster.read(follower, 100)
+    assert [(e.order_id, e.seq) for e in follower_events] == [("1", 7)]
+    assert follower.coalesced == 3
+    stats = {row["client_id"]: row for row in broadcaster.stats()}
+    assert stats[follower.client_id]["max_lag"] == 4
+    assert stats[follower.client_id]["lag"] == 0
+
+
+def test_coalesced_backlog_is_delivered_in_chunks_of_the_read_limit():
+    broadcaster = Broadcaster(buffer_size=10)
+    firehose = broadcaster.subscribe()
+    for order_id in range(25):
+        broadcaster.publish(event(order_id))
+    first = broadcaster.read(firehose, 10)
+    assert [e.seq for e in first] == list(range(1, 11))
+    assert broadcaster.lag(firehose) == 15
+    broadcaster.publish(event("late"))
+    second = broadcaster.read(firehose, 10)
+    third = broadcaster.read(firehose, 10)
+    assert [e.seq for e in second + third] == list(range(11, 26))
+    # The newer event only follows once the coalesced events are delivered
+    assert [e.seq for e in broadcaster.read(firehose, 10)] == [26]
+    assert firehose.coalesced == 0 and broadcaster.lag(firehose) == 0
+
+
+def test_order_subscriptions_only_receive_their_orders():
+    broadcaster = Broadcaster()
+    firehose = broadcaster.subscribe()
+    follower = broadcaster.subscribe(["1", "2"])
+    other = broadcaster.subscribe(["3"])
+    broadcaster.publish(event("1"))
+    broadcaster.publish(event("2"))
+    assert broadcaster.pending_count(firehose) == 2
+    assert broadcaster.pending_count(follower) == 2
+    assert broadcaster.pending_count(other) == 0
+    assert not other.wakeup.is_set()
+    broadcaster.unsubscribe(follower)
+    assert "1" not in broadcaster.by_order
+    assert broadcaster.by_order == {"3": {other}}
+
+
+def test_last_event_id_replays_missed_events():
+    broadcaster = Broadcaster()
+    for i in range(5):
+        broadcaster.publish(event(i % 2))
+    resumed = broadcaster.subscribe(last_event_id=2)
+    assert [e.seq for e in broadcaster.read(resumed, 10)] == [3, 4, 5]
+    resumed_filtered = broadcaster.subscribe(["0"], last_event_id=2)
+    assert [e.seq for e in broadcaster.read(resumed_filtered, 10)] == [3, 5]
+    fresh = broadcaster.subscribe()
+    assert broadcaster.read(fresh, 10) == []
+
+
+def test_last_event_id_from_another_process_is_ignored(monkeypatch):
+    broadcaster = Broadcaster()
+    monkeypatch.setattr(main, "broadcaster", broadcaster)
+    epoch = broadcaster.buffer.epoch
+    assert main.parse_last_event_id(f"{epoch}-2") == 2
+    # Same seq, issued by a restarted process or another replica
+    assert main.parse_last_event_id(f"{Broadcaster().buffer.epoch}-2") is None
+    assert main.parse_last_event_id("2") is None
+    assert main.parse_last_event_id(f"{epoch}-x") is None
+
+
+def test_named_event_frames_carry_status():
+    broadcaster = Broadcaster()
+    plain = broadcaster.subscribe()
+    named = broadcaster.subscribe(named_events=True)
+    broadcaster.publish(event("7", "making"))
+    epoch = broadcaster.buffer.epoch
+    assert main.frames(plain, broadcaster.read(plain, 10)) == f'id: {epoch}-1\ndata: {{"order_id": "7", "status": "making"}}\n\n'.encode()
+    assert main.frames(named, broadcaster.read(named, 10)).startswith(f"id: {epoch}-1\nevent: making\ndata: ".encode())
+
+
+def test_parse_order_ids_accepts_repeated_and_comma_separated():
+    assert main.parse_order_ids(["a,b", "c"]) == ["a", "b", "c"]
+    assert main.parse_order_ids(None) == []
+
+
+@pytest.mark.asyncio
+async def test_event_stream_formats_frames_and_unsubscribes():
+    sub = main.broadcaster.subscribe()
+    published = main.broadcaster.publish(b'{"status": "received"}')
+    stream = main.event_stream(sub)
+    assert await stream.__anext__() == f'id: {main.broadcaster.buffer.epoch}-{published.seq}\ndata: {{"status": "received"}}\n\n'.encode()
+    await stream.aclose()
+    assert sub not in main.broadcaster.clients
+
+
+@pytest.mark.asyncio
+async def test_event_stream_writes_pending_messages_as_one_chunk(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_MAX_BATCH", 3)
+    sub = main.broadcaster.subscribe()
+    for i in range(5):
+        main.broadcaster.publish(f"event-{i}".encode())
+    stream = main.event_stream(sub)
+    first_chunk = await stream.__anext__()
+    second_chunk = await stream.__anext__()
+    await stream.aclose()
+    assert first_chunk.count(b"data: ") == 3
+    assert b"data: event-0\n\n" in first_chunk and b"data: event-2\n\n" in first_chunk
+    assert second_chunk.count(b"data: ") == 2
+    assert second_chunk.endswith(b"data: event-4\n\n")
+
+
+class FakeStreamRedis:
+    """Minimal consumer-group semantics: one pending entry left over from a previous run, then new entries."""
+    def __init__(self):
+        self.pending = [(b"1-0", {b"data": event("1", "received")})]
+        self.new = [(b"2-0", {b"data": event("1", "making")})]
+        self.acked = []
+        self.groups = {}
+
+    async def xgroup_create(self, stream, group, id="$", mkstream=False):
+        self.groups[(stream, group)] = id
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        if streams["orders"] == "0":
+            entries = [e for e in self.pending if e[0] not in self.acked]
+        else:
+            entries, self.new = self.new, []
+            if not entries:
+                await asyncio.sleep(3600)
+        return [[b"orders", entries]] if entries else []
+
+    async def xack(self, stream, group, *ids):
+        self.acked.extend(ids)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_stream_listener_resumes_pending_then_reads_new_entries(monkeypatch):
+    fake = FakeStreamRedis()
+    monkeypatch.setattr(listeners.aioredis, "from_url", lambda url: fake)
+    broadcaster = Broadcaster()
+    sub = broadcaster.subscribe(["1"])
+    task = asyncio.create_task(listeners.redis_stream_listener(
+        broadcaster, "redis://", "orders", "group", "consumer", group_lookback_seconds=60
+    ))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert ['"received"' in e.data or '"making"' in e.data for e in broadcaster.read(sub, 10)] == [True, True]
+    assert fake.acked == [b"1-0", b"2-0"]
+    # A new group starts a minute back rather than at the end of the stream
+    start_ms = int(fake.groups[("orders", "group")].split("-")[0])
+    assert abs(start_ms / 1000 - (time.time() - 60)) < 5
+    assert listeners.group_start_id(0) == "$"
+
+
+def test_streams_transport_requires_a_stable_consumer_group(monkeypatch):
+    monkeypatch.setattr(main, "EVENT_TRANSPORT", "streams")
+    monkeypatch.setattr(main, "STATUS_SERVICE_CONSUMER_GROUP", None)
+    with pytest.raises(RuntimeError, match="STATUS_SERVICE_CONSUMER_GROUP"):
+        with TestClient(main.app):
+            pass
+
+
+def test_needed_channels_follow_connected_clients():
+    broadcaster = Broadcaster()
+    assert broadcaster.needed_channels("orders", 1) == {"orders"}
+    assert broadcaster.needed_channels("orders", 4) == set()
+    follower = broadcaster.subscribe(["42"])
+    assert broadcaster.needed_channels("orders", 4) == {shard_channel("orders", "42", 4)}
+    firehose = broadcaster.subscribe()
+    assert broadcaster.needed_channels("orders", 4) == {"orders:0", "orders:1", "orders:2", "orders:3"}
+    broadcaster.unsubscribe(firehose)
+    broadcaster.unsubscribe(follower)
+    assert broadcaster.needed_channels("orders", 4) == set()
+    assert broadcaster.subscriptions_changed.is_set()
+
+
+def test_heartbeat_scheduler_pings_only_idle_connections():
+    broadcaster = Broadcaster()
+    scheduler = HeartbeatScheduler(interval=3, tick=1)
+    idle, busy = broadcaster.subscribe(), broadcaster.subscribe()
+    scheduler.add(idle, now=0)
+    scheduler.add(busy, now=0)
+    assert scheduler.advance(now=1) == 0
+    busy.last_write = 2
+    assert scheduler.advance(now=2) == 0
+    assert scheduler.advance(now=3) == 1
+    assert idle.ping_due and idle.wakeup.is_set()
+    assert not busy.ping_due
+    # The busy connection was rescheduled relative to its last write
+    assert [scheduler.advance(now=t) for t in (4, 5)] == [0, 1]
+    assert busy.ping_due
+    scheduler.remove(idle)
+    assert all(idle not in slot for slot in scheduler.slots)
+
+
+@pytest.mark.asyncio
+async def test_event_stream_sends_ping_when_flagged():
+    sub = main.broadcaster.subscribe()
+    main.heartbeats.add(sub)
+    stream = main.event_stream(sub)
+    next_frame = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)
+    sub.ping_due = True
+    sub.wakeup.set()
+    assert await next_frame == b":ping\n\n"
+    await stream.aclose()
+
+
+def test_packed_frames_are_length_prefixed_msgpack():
+    broadcaster = Broadcaster()
+    published = broadcaster.publish(event("9", "ready"))
+    assert unpack_frames(published.packed_frame * 2) == [{"id": f"{broadcaster.buffer.epoch}-1", "order_id": "9", "status": "ready"}] * 2
+    with pytest.raises(ValueError):
+        unpack_frames(published.packed_frame[:-1])
+
+
+def test_update_changes_subscriptions_of_connected_client():
+    broadcaster = Broadcaster()
+    sub = broadcaster.subscribe(["1", "2"])
+    broadcaster.publish(event("1"))
+    broadcaster.publish(event("2"))
+    broadcaster.update(sub, ["2", "3"])
+    # Unread events of orders still followed are kept
+    assert [e.order_id for e in broadcaster.read(sub, 10)] == ["2"]
+    assert set(broadcaster.by_order) == {"2", "3"}
+    broadcaster.update(sub, (), firehose=True)
+    assert broadcaster.by_order == {} and sub in broadcaster.firehose
+    broadcaster.publish(event("4"))
+    assert [e.order_id for e in broadcaster.read(sub, 10)] == ["4"]
+
+
+def test_websocket_subscribes_and_receives_packed_events():
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws?order_id=1") as ws:
+        ws.send_bytes(pack_frame({"action": "subscribe", "order_ids": [2]}))
+        assert unpack_frames(ws.receive_bytes()) == [{"ack": "subscribe", "order_ids": ["1", "2"]}]
+        ws.portal.call(main.broadcaster.publish, event("3"))
+        ws.portal.call(main.broadcaster.publish, event("2", "making"))
+        [message] = unpack_frames(ws.receive_bytes())
+        assert message["order_id"] == "2" and message["status"] == "making"
+        ws.send_text('{"action": "unsubscribe"}')
+        assert unpack_frames(ws.receive_bytes()) == [{"ack": "unsubscribe", "order_ids": []}]
+        ws.send_text('{"action": "shout"}')
+        assert "error" in unpack_frames(ws.receive_bytes())[0]
+        # Invalid order_ids get an error reply and the socket stays usable
+        for bad in ('{"action": "subscribe", "order_ids": 5}', '{"action": "subscribe", "order_ids": [[1]]}'):
+            ws.send_text(bad)
+            assert "error" in unpack_frames(ws.receive_bytes())[0]
+        ws.send_text('{"action": "subscribe", "order_ids": ["4"]}')
+        assert unpack_frames(ws.receive_bytes()) == [{"ack": "subscribe", "order_ids": ["4"]}]
+
+
+def test_negotiate_encoding_respects_server_preference_and_q_zero():
+    assert negotiate_encoding("gzip, deflate, br", ["deflate", "gzip"]) == "deflate"
+    assert negotiate_encoding("gzip;q=0, deflate", ["gzip", "deflate"]) == "deflate"
+    # An explicit refusal wins over the wildcard
+    assert negotiate_encoding("gzip;q=0, *", ["gzip", "deflate"]) == "deflate"
+    assert negotiate_encoding("gzip;q=0, *", ["gzip"]) is None
+    assert negotiate_encoding("gzip", []) is None
+    assert negotiate_encoding(None, ["gzip"]) is None
+
+
+def test_stream_compressor_chunks_decode_independently_and_share_context():
+    compressor = StreamCompressor("gzip")
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    frame = b'data: {"order_id": "1", "status": "inventory_check", "message": "Inventory check for order 1"}\n\n'
+    first = compressor.compress(frame)
+    # Each chunk is flushed, so it decodes without waiting for the next one
+    assert decoder.decompress(first) == frame
+    second = compressor.compress(frame)
+    assert decoder.decompress(second) == frame
+    assert len(second) < len(first) / 2
+
+
+@pytest.mark.asyncio
+async def test_compressed_stream_closes_the_inner_stream():
+    sub = main.broadcaster.subscribe()
+    main.broadcaster.publish(event("5"))
+    stream = compressed(main.event_stream(sub), StreamCompressor("deflate"))
+    assert zlib.decompressobj().decompress(await stream.__anext__()).startswith(b"id: ")
+    await stream.aclose()
+    assert sub not in main.broadcaster.clients
+
+
+def test_projection_tracks_status_history_and_stages():
+    projection = OrderProjection(ttl=60, max_orders=2)
+    broadcaster = Broadcaster(projection=projection)
+    projection.apply({"order_id": 1, "status": "received", "message": "m"}, now=10)
+    projection.apply({"order_id": 1, "status": "received", "message": "m"}, now=11)
+    broadcaster.publish(event("1", "making"))
+    state = projection.get("1")
+    assert state["status"] == "making"
+    assert [h["status"] for h in state["history"]] == ["received", "making"]
+    assert state["stages"]["received"] == 10
+    projection.apply({"order_id": "2", "status": "received", "message": ""}, now=20)
+    projection.apply({"order_id": "3", "status": "received", "message": ""}, now=90)
+    # Bounded to max_orders, least recently updated first
+    assert list(projection.orders) == ["2", "3"]
+    assert projection.expire(now=85) == 1
+    assert list(projection.orders) == ["3"]
+
+
+class FakeHashRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.lists = {}
+        self.ttls = {}
+
+    def pipeline(self, transaction=True):
+        return FakeHashPipeline(self)
+
+
+class FakeHashPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def hset(self, key, mapping):
+        self.calls.append(lambda: self.redis.hashes.setdefault(key, {}).update(mapping))
+
+    def hsetnx(self, key, field, value):
+        self.calls.append(lambda: self.redis.hashes.setdefault(key, {}).setdefault(field, value))
+
+    def rpush(self, key, *values):
+        self.calls.append(lambda: self.redis.lists.setdefault(key, []).extend(values))
+
+    def ltrim(self, key, start, end):
+        self.calls.append(lambda: self.redis.lists.__setitem__(key, self.redis.lists.get(key, [])[start:None if end == -1 else end + 1]))
+
+    def expire(self, key, ttl):
+        self.calls.append(lambda: self.redis.ttls.__setitem__(key, ttl))
+
+    def hgetall(self, key):
+        self.calls.append(lambda: dict(self.redis.hashes.get(key, {})))
+
+    def lrange(self, key, start, end):
+        self.calls.append(lambda: list(self.redis.lists.get(key, [])[start:None if end == -1 else end + 1]))
+
+    async def execute(self):
+        return [call() for call in self.calls]
+
+
+@pytest.mark.asyncio
+async def test_projection_writes_behind_and_reads_through_redis():
+    fake = FakeHashRedis()
+    writer = OrderProjection(ttl=60)
+    writer._redis = fake
+    writer.apply({"order_id": "7", "status": "analysis", "message": "Analyzing"}, now=5)
+    await writer.flush()
+    assert fake.ttls == {"order_status:7": 60, "order_status:7:history": 60}
+    # Another replica (or a restart) reads the order back from Redis
+    reader = OrderProjection()
+    reader._redis = fake
+    orders = await reader.fetch(["7", "8"])
+    assert orders["7"]["status"] == "analysis" and orders["7"]["stages"] == {"analysis": 5}
+    assert orders["8"] is None
+    assert reader.get("7") is not None and not reader._dirty
+
+
+@pytest.mark.asyncio
+async def test_projection_keeps_history_written_before_a_restart():
+    fake = FakeHashRedis()
+    before = OrderProjection()
+    before._redis = fake
+    before.apply({"order_id": "7", "status": "received", "message": "r"}, now=1)
+    before.apply({"order_id": "7", "status": "analysis", "message": "a"}, now=2)
+    await before.flush()
+    # A restarted process (or another replica) sees only the next event
+    after = OrderProjection()
+    after._redis = fake
+    after.apply({"order_id": "7", "status": "making", "message": "m"}, now=3)
+    await after.flush()
+    state = (await after.fetch(["7"]))["7"]
+    assert [h["status"] for h in state["history"]] == ["received", "analysis", "making"]
+    assert state["stages"] == {"received": 1, "analysis": 2, "making": 3}
+    assert state["status"] == "making" and state["updated_at"] == 3
+    # A later event extends the merged state rather than starting over
+    after.apply({"order_id": "7", "status": "completed", "message": "c"}, now=4)
+    await after.flush()
+    assert len(fake.lists["order_status:7:history"]) == 4
+    assert after.get("7")["stages"]["received"] == 1
+
+
+def test_failed_snapshot_lookup_releases_the_subscriber(monkeypatch):
+    async def unavailable(order_ids):
+        raise ConnectionError("Redis is down")
+    monkeypatch.setattr(main.projection, "fetch", unavailable)
+    clients = set(main.broadcaster.clients)
+    with pytest.raises(ConnectionError):
+        TestClient(main.app).get("/stream?order_id=1")
+    assert main.broadcaster.clients == clients
+    assert "1" not in main.broadcaster.by_order
+    assert not any(slot - clients for slot in main.heartbeats.slots)
+
+
+@pytest.mark.asyncio
+async def test_response_releases_subscriber_whose_body_never_started():
+    sub = main.broadcaster.subscribe(["1"])
+    main.heartbeats.add(sub)
+    response = main.SubscriberStreamingResponse(main.event_stream(sub), sub, media_type="text/event-stream")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("Client went away")
+
+    # Starlette reports the failed send as a ClientDisconnect
+    with pytest.raises(ClientDisconnect):
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    assert sub not in main.broadcaster.clients and sub.heartbeat_slot is None
+
+
+def test_order_endpoints_serve_the_projection(monkeypatch):
+    projection = OrderProjection()
+    projection.apply({"order_id": "1", "status": "making", "message": "Cooking"})
+    monkeypatch.setattr(main, "projection", projection)
+    client = TestClient(main.app)
+    assert client.get("/orders/1").json()["status"] == "making"
+    assert client.get("/orders/2").status_code == 404
+    assert client.get("/orders?ids=1,2").json()["orders"]["2"] is None
+
+
+@pytest.mark.asyncio
+async def test_stream_starts_with_snapshot_of_followed_orders():
+    sub = main.broadcaster.subscribe(["1"])
+    stream = main.event_stream(sub, main.snapshot_frame({"1": {"status": "making"}}))
+    assert await stream.__anext__() == b'event: snapshot\ndata: {"orders": {"1": {"status": "making"}}}\n\n'
+    await stream.aclose()
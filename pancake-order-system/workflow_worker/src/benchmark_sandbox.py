@@ -0,0 +1,77 @@
+"""
+Benchmark of the workflow sandbox's per-run cost. Every workflow run (and
+every replay) gets a fresh sandbox that re-imports the workflow module and
+everything it imports that is not passed through, so this cost is paid per
+workflow, on top of the workflow's own logic.
+
+Two measurements:
+  - sandbox: create N sandboxed PancakeOrderWorkflow instances, which is
+    what the worker does when a run starts or is replayed;
+  - replay: replay exported histories (JSON from the Temporal UI or
+    `temporal workflow show --output json`) with the Replayer.
+Both report wall time and worker CPU time per workflow.
+
+Usage:
+    python src/benchmark_sandbox.py [--runs 200] [--histories DIR]
+"""
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from temporalio import workflow
+from temporalio.client import WorkflowHistory
+from temporalio.contrib.pydantic import pydantic_data_converter
+from temporalio.worker import Replayer
+from temporalio.worker.workflow_sandbox import SandboxedWorkflowRunner
+
+from pancake_workflow import PancakeOrderWorkflow, NotifyCustomerWorkflow
+
+
+def report(name: str, count: int, wall: float, cpu: float) -> None:
+    print(f"{name:<8} {count:>6} workflows  {wall / count * 1000:8.2f} ms wall/workflow  {cpu / count * 1000:8.2f} ms CPU/workflow")
+
+
+async def bench_sandbox(runs: int) -> None:
+    runner = SandboxedWorkflowRunner()
+    defn = workflow._Definition.must_from_class(PancakeOrderWorkflow)
+    # The first instance also pays for the passthrough modules' real imports
+    runner.prepare_workflow(defn)
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(runs):
+        runner.prepare_workflow(defn)
+    report("sandbox", runs, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+async def bench_replay(histories_dir: Path) -> None:
+    histories = [
+        WorkflowHistory.from_json(path.stem, json.loads(path.read_text()))
+        for path in sorted(histories_dir.glob("*.json"))
+    ]
+    if not histories:
+        print(f"No *.json histories in {histories_dir}")
+        return
+    replayer = Replayer(
+        workflows=[PancakeOrderWorkflow, NotifyCustomerWorkflow],
+        data_converter=pydantic_data_converter
+    )
+    wall, cpu = time.perf_counter(), time.process_time()
+    results = await replayer.replay_workflows(histories, raise_on_replay_failure=False)
+    report("replay", len(histories), time.perf_counter() - wall, time.process_time() - cpu)
+    for run_id, failure in results.replay_failures.items():
+        print(f"  replay failed for {run_id}: {failure}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200, help="Sandboxed instances to create")
+    parser.add_argument("--histories", type=Path, help="Directory of exported workflow histories to replay")
+    args = parser.parse_args()
+    await bench_sandbox(args.runs)
+    if args.histories:
+        await bench_replay(args.histories)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
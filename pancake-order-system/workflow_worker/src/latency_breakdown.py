@@ -0,0 +1,98 @@
+"""
+Latency breakdown of completed PancakeOrderWorkflow runs, read from their
+Temporal histories. For every run it measures the end-to-end time, the queue
+wait and run time of each activity, and the "tail": the time between the last
+order step (kitchen or inventory) completing and the workflow completing,
+which is what the customer notification adds to the critical path.
+Runs are grouped by notify mode (awaited activity vs detached child workflow).
+
+Usage:
+    python src/latency_breakdown.py [--limit 200] [--query "..."]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from temporalio.api.enums.v1 import EventType
+from temporalio.client import Client
+
+load_dotenv()
+
+DEFAULT_QUERY = "WorkflowType='PancakeOrderWorkflow' AND ExecutionStatus='Completed'"
+# Steps the order's outcome depends on; anything after the last of them is notification overhead
+ORDER_STEPS = {"analyze_order", "inventory_check", "execute_order"}
+
+
+def breakdown(events) -> Dict[str, Any]:
+    """
+    Durations in milliseconds for one workflow history: 'total', 'tail',
+    '<activity>.queued' and '<activity>.run' for each activity, and
+    'child.start' for detached notification children.
+    """
+    times = {event.event_id: event.event_time.ToMilliseconds() for event in events}
+    activity_types = {}
+    started_at = {}
+    result: Dict[str, Any] = {"mode": "await"}
+    last_step_done: Optional[float] = None
+    for event in events:
+        if event.event_type == EventType.EVENT_TYPE_ACTIVITY_TASK_SCHEDULED:
+            activity_types[event.event_id] = event.activity_task_scheduled_event_attributes.activity_type.name
+        elif event.event_type == EventType.EVENT_TYPE_ACTIVITY_TASK_STARTED:
+            scheduled_id = event.activity_task_started_event_attributes.scheduled_event_id
+            started_at[scheduled_id] = times[event.event_id]
+            name = activity_types[scheduled_id]
+            result[f"{name}.queued"] = times[event.event_id] - times[scheduled_id]
+        elif event.event_type == EventType.EVENT_TYPE_ACTIVITY_TASK_COMPLETED:
+            scheduled_id = event.activity_task_completed_event_attributes.scheduled_event_id
+            name = activity_types[scheduled_id]
+            result[f"{name}.run"] = times[event.event_id] - started_at.get(scheduled_id, times[scheduled_id])
+            if name in ORDER_STEPS:
+                last_step_done = times[event.event_id]
+        elif event.event_type == EventType.EVENT_TYPE_CHILD_WORKFLOW_EXECUTION_STARTED:
+            initiated_id = event.child_workflow_execution_started_event_attributes.initiated_event_id
+            result["child.start"] = times[event.event_id] - times[initiated_id]
+            result["mode"] = "detached"
+        elif event.event_type == EventType.EVENT_TYPE_WORKFLOW_EXECUTION_COMPLETED:
+            result["total"] = times[event.event_id] - times[events[0].event_id]
+            if last_step_done is not None:
+                result["tail"] = times[event.event_id] - last_step_done
+    return result
+
+
+def summarize(runs: List[Dict[str, Any]]) -> None:
+    by_mode = defaultdict(list)
+    for run in runs:
+        by_mode[run["mode"]].append(run)
+    for mode, mode_runs in sorted(by_mode.items()):
+        print(f"\nnotify mode: {mode} ({len(mode_runs)} runs)")
+        print(f"  {'ms':<24}{'p50':>10}{'p95':>10}{'max':>10}")
+        keys = sorted({k for run in mode_runs for k in run if k != "mode"})
+        for key in keys:
+            values = sorted(run[key] for run in mode_runs if key in run)
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            print(f"  {key:<24}{statistics.median(values):>10.0f}{p95:>10.0f}{values[-1]:>10.0f}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--query", default=DEFAULT_QUERY, help="Visibility query selecting the runs")
+    parser.add_argument("--limit", type=int, default=200, help="Most recent runs to analyze")
+    args = parser.parse_args()
+
+    client = await Client.connect(os.getenv("TEMPORAL_ADDRESS", "localhost:7233"))
+    runs = []
+    async for execution in client.list_workflows(args.query, limit=args.limit):
+        history = await client.get_workflow_handle(execution.id, run_id=execution.run_id).fetch_history()
+        runs.append(breakdown(history.events))
+    if not runs:
+        print("No completed runs found")
+        return
+    summarize(runs)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
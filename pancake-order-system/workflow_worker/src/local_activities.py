@@ -0,0 +1,23 @@
+# Activities the workflow worker can run as local activities (WORKFLOW_LOCAL_STEPS)
+import logging
+
+from temporalio import activity
+
+logger = logging.getLogger("workflow_worker.local_activities")
+
+@activity.defn(name="notify")
+async def notify(order_id: str, message: str) -> str:
+    """
+    Same contract as the notify worker's activity, run inside the workflow
+    worker so the step needs no task-queue round trip.
+    Args:
+        order_id: Unique identifier for the order
+        message: Notification for the customer
+    Returns:
+        "Order completed" or "Order not completed"
+    """
+    if message == "Order completed":
+        logger.info(f"Order completed for order_id={order_id}")
+        return "Order completed"
+    logger.info(f"Order not completed for order_id={order_id}")
+    return "Order not completed"
@@ -4,7 +4,9 @@ from temporalio.client import Client
 from temporalio.worker import Worker
 from temporalio.contrib.pydantic import pydantic_data_converter
 from shared.logging_config import setup_logging
-from pancake_workflow import PancakeOrderWorkflow
+from shared.temporal_context import TemporalContextInterceptor
+from pancake_workflow import PancakeOrderWorkflow, NotifyCustomerWorkflow
+from local_activities import notify
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,15 +20,18 @@ async def main():
         
         client = await Client.connect(
             temporal_server,
-            data_converter=pydantic_data_converter
+            data_converter=pydantic_data_converter,
+            interceptors=[TemporalContextInterceptor()]
         )
         logger.info("Successfully connected to Temporal server")
 
-        logger.info("Initializing workflow worker with PancakeOrderWorkflow")
+        logger.info("Initializing workflow worker with PancakeOrderWorkflow and NotifyCustomerWorkflow")
         worker = Worker(
             client,
             task_queue="pancake-task-queue",
-            workflows=[PancakeOrderWorkflow]
+            workflows=[PancakeOrderWorkflow, NotifyCustomerWorkflow],
+            # Only run as local activities, for workflows started with them in local_steps
+            activities=[notify]
         )
 
         logger.info("Starting workflow worker - listening for pancake orders")
@@ -1,23 +1,70 @@
+# Only deterministic, sandbox-safe code belongs in this module: the sandbox
+# re-imports it for every workflow run and replay. Configuration, Redis and
+# other I/O live in the activities and in main.py.
 from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
 from temporalio import workflow
 from temporalio.common import RetryPolicy
-from typing import Dict, List
-from shared.interface import OrderRequest, Ingredients
-from dotenv import load_dotenv
-import os
+from temporalio.workflow import ParentClosePolicy
 
 # workflow is kicked off by the order_service, by call to /order endpoint
 # order_service will pass in the 
 # order_id
 # order_details
-# ingredient_requirements   
 
-from shared.event_publisher import EventPublisher
-import asyncio
+# The models (and pydantic behind them) are loaded once per worker, not per run
+with workflow.unsafe.imports_passed_through():
+    from shared.interface import OrderRequest
+
+# How PancakeOrderWorkflow notifies the customer
+NOTIFY_DETACHED = "detached"  # Hand off to NotifyCustomerWorkflow and finish without waiting for it
+NOTIFY_AWAIT = "await"  # Wait for the notify activity before finishing (the original behaviour)
+
+# Marks histories recorded with detached notifications; older ones replay the awaited activity
+DETACHED_NOTIFY_PATCH = "detached-notify"
+
+NOTIFY_RETRY_POLICY = RetryPolicy(
+    initial_interval=timedelta(seconds=1),
+    maximum_interval=timedelta(seconds=30),
+    maximum_attempts=10,
+)
 
-load_dotenv()
+async def execute_step(
+    activity: str,
+    args: List[Any],
+    task_queue: str,
+    local_steps: Optional[List[str]],
+    **options: Any
+) -> Any:
+    """
+    Run one pipeline step as a regular activity on its task queue, or, if the
+    step is listed in local_steps, as a local activity inside this worker. A
+    local step skips the schedule, poll and completion round trips through the
+    server and records a single marker event instead of three activity events.
+    Its activity must be registered on the workflow worker.
+    """
+    if local_steps and activity in local_steps:
+        return await workflow.execute_local_activity(activity, args=args, **options)
+    return await workflow.execute_activity(activity, args=args, task_queue=task_queue, **options)
 
-REDIS_CHANNEL = os.getenv("REDIS_CHANNEL", "orders")
+@workflow.defn
+class NotifyCustomerWorkflow:
+    """
+    Sends one customer notification on behalf of a finished order. Started as
+    an abandoned child, so it outlives the order workflow and retries on its
+    own without holding up the order's completion.
+    """
+    @workflow.run
+    async def run(self, order_id: str, message: str, local: bool = False, colocated: bool = False) -> str:
+        return await execute_step(
+            "notify",
+            [order_id, message],
+            workflow.info().task_queue if colocated else "notification-task-queue",
+            ["notify"] if local else None,
+            start_to_close_timeout=timedelta(seconds=10),
+            retry_policy=NOTIFY_RETRY_POLICY
+        )
 
 @workflow.defn
 class PancakeOrderWorkflow:
@@ -25,7 +72,10 @@ class PancakeOrderWorkflow:
     async def run(
         self,
         order_id: str,
-        order_details: OrderRequest
+        order_details: OrderRequest,
+        notify_mode: str = NOTIFY_DETACHED,
+        local_steps: Optional[List[str]] = None,
+        colocated: bool = False
     ) -> Dict[str, str]:
         """
         Run the pancake order workflow.
@@ -33,11 +83,19 @@ class PancakeOrderWorkflow:
         Args:
             order_id: Unique identifier for the order
             order_details: Order details including customer information
-            ingredient_requirements: List of required ingredients
+            notify_mode: NOTIFY_DETACHED (default) ends the workflow as soon as the
+                notification is handed off; NOTIFY_AWAIT waits for it to be sent
+            local_steps: Activities to run as local activities in this worker
+                (e.g. ["notify"]); all others run on their own task queues
+            colocated: Run every remote step on this workflow's task queue, for a
+                worker that hosts all activities (see all_in_one); their tasks
+                are then handed to it eagerly instead of through matching
             
         Returns:
             Dictionary containing workflow execution results
         """
+        self.local_steps = local_steps
+        self.colocated = colocated
         # Add logging for workflow start
         workflow.logger.info(f"Workflow started for order_id={order_id}, customer={order_details.customer_name}")
         retry_policy = RetryPolicy(
@@ -50,24 +108,22 @@ class PancakeOrderWorkflow:
         # Analyze the order
         #######################
         workflow.logger.info(f"Analyzing order: {order_details.customer_order}")
-        required_ingredients = await workflow.execute_activity(
+        required_ingredients = await self.step(
             "analyze_order",
+            [order_details.customer_order],
+            "analyze-order-queue",
             start_to_close_timeout=timedelta(seconds=30),
-            retry_policy=retry_policy,
-            task_queue="analyze-order-queue",
-            args=[
-                order_details.customer_order
-            ]
+            retry_policy=retry_policy
         )
         workflow.logger.info(f"Required ingredients: {required_ingredients}")
         #######################
         # Inventory check
         #######################
         workflow.logger.info(f"Checking inventory for order_id={order_id}")
-        inventory_check_result = await workflow.execute_activity(
+        inventory_check_result = await self.step(
             "inventory_check",
-            args=[order_id, required_ingredients],
-            task_queue="inventory-task-queue",
+            [order_id, required_ingredients],
+            "inventory-task-queue",
             schedule_to_close_timeout=timedelta(seconds=30)
         )
         workflow.logger.info(f"Inventory check result: {inventory_check_result}")
@@ -77,21 +133,16 @@ class PancakeOrderWorkflow:
         ####################### 
         if inventory_check_result["decision"] == "make":
             workflow.logger.info(f"Decision: MAKE. Sending to kitchen.")
-            kitchen_result = await workflow.execute_activity(
+            kitchen_result = await self.step(
                 "execute_order",
-                args=[order_id, required_ingredients],
-                task_queue="kitchen-task-queue",
+                [order_id, required_ingredients],
+                "kitchen-task-queue",
                 schedule_to_close_timeout=timedelta(seconds=30)
             )
             workflow.logger.info(f"Kitchen result: {kitchen_result}")
             # call the notify activity
             workflow.logger.info(f"Notifying customer: Order completed for order_id={order_id}")
-            await workflow.execute_activity(
-                "notify",
-                args=[order_id, "Order completed"],
-                task_queue="notification-task-queue",
-                schedule_to_close_timeout=timedelta(seconds=10)
-            )
+            await self.notify(order_id, "Order completed", notify_mode, timedelta(seconds=10))
 
             return kitchen_result
         else:
@@ -99,11 +150,34 @@ class PancakeOrderWorkflow:
             # notify the customer about missing ingredients
             #######################  
             workflow.logger.info(f"Decision: NO MAKE. Notifying customer about missing ingredients.")
-            await workflow.execute_activity(
-                "notify",
-                args=[order_id, "Not enough ingredients to make the order"],
-                task_queue="notification-task-queue",
-                schedule_to_close_timeout=timedelta(seconds=30)
-            )
+            await self.notify(order_id, "Not enough ingredients to make the order", notify_mode, timedelta(seconds=30))
             return inventory_check_result
 
+    async def step(self, activity: str, args: List[Any], task_queue: str, **options: Any) -> Any:
+        """Run a pipeline step with this run's local_steps and colocated options."""
+        if self.colocated:
+            task_queue = workflow.info().task_queue
+        return await execute_step(activity, args, task_queue, self.local_steps, **options)
+
+    async def notify(self, order_id: str, message: str, notify_mode: str, timeout: timedelta) -> None:
+        """
+        Notify the customer. In detached mode this only waits for the child
+        workflow to start (one server round trip), not for the notify worker to
+        pick up and run the activity.
+        """
+        if notify_mode == NOTIFY_DETACHED and workflow.patched(DETACHED_NOTIFY_PATCH):
+            await workflow.start_child_workflow(
+                NotifyCustomerWorkflow.run,
+                args=[order_id, message, bool(self.local_steps and "notify" in self.local_steps), self.colocated],
+                id=f"{workflow.info().workflow_id}-notify",
+                task_queue=workflow.info().task_queue,
+                parent_close_policy=ParentClosePolicy.ABANDON
+            )
+            return
+        await self.step(
+            "notify",
+            [order_id, message],
+            "notification-task-queue",
+            schedule_to_close_timeout=timeout
+        )
+
@@ -0,0 +1,50 @@
+# Unit tests for the workflow history latency breakdown
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from temporalio.api.enums.v1 import EventType
+from temporalio.api.history.v1 import HistoryEvent
+
+from latency_breakdown import breakdown
+
+
+def event(event_id, ms, event_type, **attributes):
+    e = HistoryEvent(event_id=event_id, event_type=event_type, **attributes)
+    e.event_time.FromMilliseconds(ms)
+    return e
+
+
+def activity(first_id, name, scheduled_ms, started_ms, completed_ms):
+    return [
+        event(first_id, scheduled_ms, EventType.EVENT_TYPE_ACTIVITY_TASK_SCHEDULED,
+              activity_task_scheduled_event_attributes={"activity_type": {"name": name}}),
+        event(first_id + 1, started_ms, EventType.EVENT_TYPE_ACTIVITY_TASK_STARTED,
+              activity_task_started_event_attributes={"scheduled_event_id": first_id}),
+        event(first_id + 2, completed_ms, EventType.EVENT_TYPE_ACTIVITY_TASK_COMPLETED,
+              activity_task_completed_event_attributes={"scheduled_event_id": first_id}),
+    ]
+
+
+def test_awaited_notify_is_counted_in_the_tail():
+    events = [event(1, 0, EventType.EVENT_TYPE_WORKFLOW_EXECUTION_STARTED)]
+    events += activity(2, "execute_order", 10, 30, 530)
+    events += activity(5, "notify", 540, 700, 720)
+    events.append(event(8, 735, EventType.EVENT_TYPE_WORKFLOW_EXECUTION_COMPLETED))
+    result = breakdown(events)
+    assert result["mode"] == "await"
+    assert result["total"] == 735 and result["tail"] == 205
+    assert result["notify.queued"] == 160 and result["execute_order.run"] == 500
+
+
+def test_detached_notify_only_waits_for_the_child_to_start():
+    events = [event(1, 0, EventType.EVENT_TYPE_WORKFLOW_EXECUTION_STARTED)]
+    events += activity(2, "execute_order", 10, 30, 530)
+    events.append(event(5, 540, EventType.EVENT_TYPE_START_CHILD_WORKFLOW_EXECUTION_INITIATED))
+    events.append(event(6, 548, EventType.EVENT_TYPE_CHILD_WORKFLOW_EXECUTION_STARTED,
+                        child_workflow_execution_started_event_attributes={"initiated_event_id": 5}))
+    events.append(event(7, 560, EventType.EVENT_TYPE_WORKFLOW_EXECUTION_COMPLETED))
+    result = breakdown(events)
+    assert result["mode"] == "detached"
+    assert result["child.start"] == 8 and result["tail"] == 30
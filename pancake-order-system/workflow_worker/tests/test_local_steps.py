@@ -0,0 +1,65 @@
+# Unit tests for running pipeline steps as local or remote activities
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+
+from temporalio import workflow
+from temporalio.testing import ActivityEnvironment
+
+import pancake_workflow
+from local_activities import notify
+
+
+def record_calls(monkeypatch):
+    calls = []
+
+    async def execute_activity(activity, **kwargs):
+        calls.append(("remote", activity, kwargs))
+
+    async def execute_local_activity(activity, **kwargs):
+        calls.append(("local", activity, kwargs))
+
+    monkeypatch.setattr(workflow, "execute_activity", execute_activity)
+    monkeypatch.setattr(workflow, "execute_local_activity", execute_local_activity)
+    return calls
+
+
+def test_listed_steps_run_as_local_activities(monkeypatch):
+    calls = record_calls(monkeypatch)
+    timeout = timedelta(seconds=10)
+    asyncio.run(pancake_workflow.execute_step("notify", ["42", "Order completed"], "notification-task-queue",
+                                              ["notify"], start_to_close_timeout=timeout))
+    asyncio.run(pancake_workflow.execute_step("execute_order", ["42", None], "kitchen-task-queue",
+                                              ["notify"], start_to_close_timeout=timeout))
+    assert calls == [
+        ("local", "notify", {"args": ["42", "Order completed"], "start_to_close_timeout": timeout}),
+        ("remote", "execute_order", {"args": ["42", None], "task_queue": "kitchen-task-queue", "start_to_close_timeout": timeout}),
+    ]
+
+
+def test_steps_are_remote_by_default(monkeypatch):
+    calls = record_calls(monkeypatch)
+    asyncio.run(pancake_workflow.execute_step("notify", ["42", "Order completed"], "notification-task-queue", None))
+    assert calls[0][:2] == ("remote", "notify")
+
+
+def test_colocated_steps_run_on_the_workflow_task_queue(monkeypatch):
+    calls = record_calls(monkeypatch)
+    monkeypatch.setattr(workflow, "info", lambda: SimpleNamespace(task_queue="pancake-task-queue"))
+    wf = pancake_workflow.PancakeOrderWorkflow()
+    wf.local_steps, wf.colocated = ["notify"], True
+    asyncio.run(wf.step("execute_order", ["42", None], "kitchen-task-queue"))
+    asyncio.run(wf.step("notify", ["42", "Order completed"], "notification-task-queue"))
+    assert calls[0] == ("remote", "execute_order", {"args": ["42", None], "task_queue": "pancake-task-queue"})
+    assert calls[1][:2] == ("local", "notify")
+
+
+def test_local_notify_matches_the_notify_worker():
+    env = ActivityEnvironment()
+    assert env.run(lambda: asyncio.run(notify("42", "Order completed"))) == "Order completed"
+    assert env.run(lambda: asyncio.run(notify("42", "Not enough ingredients to make the order"))) == "Order not completed"
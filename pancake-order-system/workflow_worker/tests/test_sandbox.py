@@ -0,0 +1,31 @@
+# The workflow module is re-imported by the sandbox for every run; keep it light
+import os
+import subprocess
+import sys
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_workflow_module_does_not_import_io_modules():
+    code = "import sys, pancake_workflow; print(sorted(m for m in ('redis', 'dotenv', 'shared.event_publisher') if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC, ROOT]))
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_workflows_pass_sandbox_validation():
+    code = """
+import asyncio
+from temporalio import workflow
+from temporalio.worker.workflow_sandbox import SandboxedWorkflowRunner
+from pancake_workflow import PancakeOrderWorkflow, NotifyCustomerWorkflow
+
+async def main():
+    for cls in (PancakeOrderWorkflow, NotifyCustomerWorkflow):
+        SandboxedWorkflowRunner().prepare_workflow(workflow._Definition.must_from_class(cls))
+
+asyncio.run(main())
+"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC, ROOT]))
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
@@ -11,6 +11,7 @@ SERVICES=(
   "activity_workers/kitchen"
   "activity_workers/notify"
   "status_service"
+  "all_in_one"
 )
 
 for service in "${SERVICES[@]}"; do